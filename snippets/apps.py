@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SnippetsConfig(AppConfig):
     name = 'snippets'
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
@@ -0,0 +1,126 @@
+"""
+读操作的异步视图
+
+在ASGI下（见`tutorial/asgi.py`），同步视图每个请求都要占用一个线程，并发连接数受限于线程池；
+开启`SNIPPETS['ASYNC_VIEWS']`后，`list`、`retrieve`和`highlight`的GET/HEAD请求由协程处理：
+查询使用Django的异步ORM，缓存使用缓存的异步接口，高亮渲染和解压这样的CPU密集操作放到线程池中执行，
+不会阻塞事件循环。写操作、HTTP认证的请求和其他操作仍然执行原来的同步视图（通过`sync_to_async`）。
+
+DRF没有异步视图，这里复用它的请求包装、认证、内容协商、权限检查、异常处理和响应处理，
+认证需要的用户事先用`request.auser()`异步取出，这些步骤就不再查询数据库。
+分页类和条件请求的验证器是同步的，通过`sync_to_async`在请求专用的线程中执行。
+"""
+import asyncio
+from functools import partial, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404
+from rest_framework.mixins import ListModelMixin
+from rest_framework.response import Response
+
+from .conf import snippets_setting
+
+# 线程池中的迭代器结束时返回的标记
+_DONE = object()
+
+
+async def iterate_in_executor(iterator, thread_sensitive=False):
+    """在线程池中逐块执行同步迭代器，每一块都不会阻塞事件循环
+
+    迭代时查询数据库的迭代器需要`thread_sensitive=True`，在同步视图所在的线程中执行，使用它的数据库连接"""
+    loop = asyncio.get_running_loop()
+    step = sync_to_async(next) if thread_sensitive else partial(loop.run_in_executor, None, next)
+    iterator = iter(iterator)
+    while True:
+        chunk = await step(iterator, _DONE)
+        if chunk is _DONE:
+            return
+        yield chunk
+
+
+def stream_wrapper(request, thread_sensitive=False):
+    """ASGI请求的流式响应改为异步迭代，WSGI下仍然使用同步迭代器
+
+    同步视图和异步视图都需要它：ASGI下Django会把同步迭代器的流式响应整个读入内存再发送"""
+    if not isinstance(request._request, ASGIRequest):
+        return None
+    return partial(iterate_in_executor, thread_sensitive=thread_sensitive)
+
+
+class AsyncReadMixin:
+    """视图集的`as_view()`返回异步视图，`async_actions`中的操作由对应的`a<action>()`协程处理"""
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not snippets_setting('ASYNC_VIEWS') or not set(actions.values()) & set(cls.async_actions):
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            method = request.method.lower()
+            action = actions.get('get' if method == 'head' else method)
+            # HTTP Basic认证需要查询用户，交给同步视图
+            if method not in ('get', 'head') or action not in cls.async_actions \
+                    or 'HTTP_AUTHORIZATION' in request.META:
+                return await sync_view(request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.action_map = {**actions, 'head': action}
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        # 复制`cls`、`actions`、`csrf_exempt`等属性，路由器和中间件依赖它们
+        update_wrapper(async_view, view)
+        return async_view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """`APIView.dispatch()`的异步版本，只用于`async_actions`"""
+        request.user = await request.auser()
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            self.initial(request, *args, **kwargs)
+            response = await getattr(self, f'a{self.action}')(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self):
+        """`get_object()`的异步版本"""
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached(partial(self.aconditional, self.alist_page), request, *args, **kwargs)
+
+    async def alist_page(self, request, *args, **kwargs):
+        if not snippets_setting('FAST_LIST_SERIALIZATION'):
+            return await sync_to_async(ListModelMixin.list)(self, request, *args, **kwargs)
+        serializer = self.values_serializer_class(request, self.format_kwarg)
+        queryset = serializer.prepare(self.filter_queryset(self.get_queryset()))
+        page = await sync_to_async(self.paginate_queryset)(queryset)
+        if page is not None:
+            return self.get_paginated_response(await serializer.adata(page))
+        return Response(await serializer.adata([row async for row in queryset]))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached(partial(self.aconditional, self.aretrieve_page), request, *args, **kwargs)
+
+    async def aretrieve_page(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        # 详情的关联数据已经一起查询（`select_related`/`prefetch_related`），序列化时不再查询
+        return Response(self.get_serializer(instance).data)
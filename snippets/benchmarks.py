@@ -0,0 +1,260 @@
+"""
+接口性能测试的公共部分：生成测试数据、执行场景、统计结果
+
+由`benchmark_api`等管理命令使用，见`snippets/management/commands/`
+"""
+import asyncio
+import io
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import urlencode
+
+from . import response_cache, search, urls
+from .bulk import render_all, store_highlighted
+from .models import Snippet
+
+# 生成代码段时使用的语言及各自的代码行
+LANGUAGE_SAMPLES = {
+    'python': ['def handler(request, *args):', '    value = compute(args[0]) * 2', '    return {"value": value}'],
+    'ruby': ['def handler(args)', '  value = compute(args.first) * 2', '  { value: value }', 'end'],
+    'javascript': ['function handler(args) {', '  const value = compute(args[0]) * 2;', '  return { value };', '}'],
+    'c': ['int handler(int *args) {', '    int value = compute(args[0]) * 2;', '    return value;', '}'],
+    'sql': ['SELECT id, title FROM snippets_snippet', 'WHERE created > NOW() - INTERVAL 1 DAY', 'ORDER BY id;'],
+    'html': ['<div class="card">', '  <p>{{ value }}</p>', '</div>'],
+}
+# 代码段长度（行数）的分布：大多数较短，少数很长
+LINE_COUNTS = [5] * 60 + [50] * 30 + [500] * 9 + [5000]
+
+
+def make_code(language, lines):
+    sample = LANGUAGE_SAMPLES[language]
+    return '\n'.join(sample[index % len(sample)] for index in range(lines)) + '\n'
+
+
+def seed(users, snippets, seed=0, batch_size=500):
+    """生成`users`个用户和`snippets`个不同语言、不同长度的代码段，返回生成的用户列表"""
+    rng = random.Random(seed)
+    User.objects.bulk_create(
+        [User(username=f'bench-{seed}-{index}') for index in range(users)], batch_size=batch_size,
+    )
+    # 部分数据库的`bulk_create`不返回主键，重新查询一次
+    owners = list(User.objects.filter(username__startswith=f'bench-{seed}-'))
+    languages = list(LANGUAGE_SAMPLES)
+
+    def flush():
+        render_all(batch)
+        store_highlighted(batch)
+        Snippet.objects.bulk_create(batch)
+        search.index_snippets(batch)
+        batch.clear()
+
+    batch = []
+    for index in range(snippets):
+        language = rng.choice(languages)
+        batch.append(Snippet(
+            owner=rng.choice(owners), title=f'snippet {index}', language=language,
+            code=make_code(language, rng.choice(LINE_COUNTS)), linenos=rng.random() < 0.5,
+        ))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    response_cache.snippets_changed([], owners=[owner.pk for owner in owners])
+    return owners
+
+
+def percentile(sorted_values, fraction):
+    """线性插值的百分位数，`sorted_values`必须已经排序"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies, queries, elapsed, errors):
+    """汇总一个场景的结果，延迟单位为毫秒"""
+    if not latencies:
+        return {'requests': 0, 'errors': errors, 'throughput_rps': None, 'latency_ms': {}, 'queries': {}}
+    latencies = sorted(seconds * 1000 for seconds in latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed,
+        'latency_ms': {
+            'mean': statistics.mean(latencies),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        },
+        'queries': {
+            'mean': statistics.mean(queries),
+            'max': max(queries),
+        } if queries else {},
+    }
+
+
+def run_scenario(request, iterations, memory_iterations=20):
+    """执行`iterations`次`request()`并统计延迟和查询次数，再用tracemalloc单独测量峰值内存
+
+    `request()`返回响应，状态码不小于400时计为错误。"""
+    latencies = []
+    queries = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            begin = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - begin)
+        queries.append(len(context.captured_queries))
+        if response.status_code >= 400:
+            errors += 1
+    result = summarize(latencies, queries, time.perf_counter() - started, errors)
+
+    # tracemalloc会明显拖慢执行，所以不和延迟放在同一轮测量
+    tracemalloc.start()
+    try:
+        for _ in range(min(memory_iterations, iterations)):
+            request()
+        result['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def build_urlconf(async_views):
+    """按`async_views`重新生成`snippets`的URL配置，用作`ROOT_URLCONF`"""
+    with override_settings(SNIPPETS={**getattr(settings, 'SNIPPETS', {}), 'ASYNC_VIEWS': async_views}):
+        urlconf = types.ModuleType(f'snippets_urls_{"async" if async_views else "sync"}')
+        urlconf.urlpatterns = urls.get_urlpatterns()
+    return urlconf
+
+
+def split_url(url):
+    path, _, query = url.partition('?')
+    return path, query
+
+
+def run_wsgi(urls, concurrency, threads, client_delay, accept='*/*'):
+    """模拟线程模型的WSGI服务器：`threads`个worker线程处理`concurrency`个客户端依次发出的请求
+
+    客户端接收每个响应需要`client_delay`秒（慢速网络），期间worker线程一直被占用。"""
+    handler = WSGIHandler()
+
+    def serve(url):
+        path, query = split_url(url)
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': accept, 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        body = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+        try:
+            for _ in body:
+                pass
+            time.sleep(client_delay)
+        finally:
+            body.close()
+        return status[0]
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=threads) as workers:
+
+        def client(url):
+            nonlocal errors
+            begin = time.perf_counter()
+            status = workers.submit(serve, url).result()
+            with lock:
+                latencies.append(time.perf_counter() - begin)
+                errors += status >= 400
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            list(clients.map(client, urls))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, [], elapsed, errors)
+
+
+def run_asgi(urls, concurrency, client_delay, accept='*/*'):
+    """在事件循环中用`concurrency`个客户端协程请求Django的ASGI应用，`client_delay`与`run_wsgi()`相同"""
+    application = ASGIHandler()
+    latencies = []
+    errors = 0
+
+    async def request(url):
+        nonlocal errors
+        path, query = split_url(url)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'testserver'), (b'accept', accept.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        received = False
+        status = None
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # 客户端不会断开连接，Django在响应结束后取消这个等待
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                await asyncio.sleep(client_delay)
+
+        begin = time.perf_counter()
+        await application(scope, receive, send)
+        latencies.append(time.perf_counter() - begin)
+        errors += status is None or status >= 400
+
+    async def client(queue):
+        while queue:
+            await request(queue.pop())
+
+    async def main():
+        queue = list(reversed(urls))
+        await asyncio.gather(*(client(queue) for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return summarize(latencies, [], time.perf_counter() - started, errors)
+
+
+def request_mix(pks, requests, page_size, rng):
+    """并发测试使用的读请求：列表、详情和高亮页面各占三分之一"""
+    page = urlencode({'page_size': page_size})
+    choices = [
+        lambda: f'/snippets/?{page}',
+        lambda: f'/snippets/{rng.choice(pks)}/',
+        lambda: f'/snippets/{rng.choice(pks)}/highlight/',
+    ]
+    return [choices[index % len(choices)]() for index in range(requests)]
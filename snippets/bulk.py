@@ -0,0 +1,160 @@
+"""
+批量导入代码段
+
+逐条`POST /snippets/`时每一条都要单独验证、单独INSERT并同步渲染高亮。批量导入把数据分成批次：
+1. 逐条验证，验证失败的条目记录下错误并跳过，不影响同一批的其他条目
+2. 缓存中没有的高亮结果交给进程池并行渲染（见`snippets.tasks`），超大的代码逐块渲染
+3. 高亮结果按内容去重后批量写入`Blob`表，见`snippets.models.Blob`和`snippets.models.HighlightChunk`
+4. 每一批在一个事务中用`bulk_create`插入，避免长时间持有数据库的写锁
+`bulk_create`不会发送`post_save`信号，所以插入后直接写入全文索引并使响应缓存失效
+
+`rerender`用同样的方式批量刷新已经保存的代码段，见`rerender_snippets`命令
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+
+from . import highlight, response_cache, search
+from .conf import snippets_setting
+from .models import Blob, HighlightChunk, Snippet
+from .tasks import get_executor
+
+
+def render_all(snippets, executor=None):
+    """为一批代码段填充`highlighted`和`render_fingerprint`，缓存未命中的部分在进程池中并行渲染
+
+    超过`SNIPPETS['HIGHLIGHT_MAX_BYTES']`的代码逐块渲染，结果放在`snippet.rendered_chunks`中，
+    由`store_chunks()`在插入或更新数据行之后写入"""
+    misses = {}
+    for snippet in snippets:
+        inputs = snippet.render_inputs()
+        snippet.render_fingerprint = highlight.render_key(*inputs)
+        snippet.rendered_chunks = None
+        if highlight.is_oversized(snippet.code):
+            snippet.highlighted = ''
+            snippet.render_status = Snippet.RENDER_CHUNKED
+            misses.setdefault(snippet.render_fingerprint, (inputs, []))[1].append(snippet)
+            continue
+        highlighted = highlight.cached_lookup(*inputs)
+        if highlighted is None:
+            misses.setdefault(snippet.render_fingerprint, (inputs, []))[1].append(snippet)
+        else:
+            snippet.highlighted = highlighted
+            snippet.render_status = Snippet.RENDER_DONE
+
+    renderers = [highlight.timed_render_chunks if highlight.is_oversized(inputs[0]) else highlight.timed_render
+                 for inputs, _ in misses.values()]
+    if len(misses) > 1:
+        # 内容相同的代码段只渲染一次
+        rendered = (executor or get_executor()).map(call, renderers, (inputs for inputs, _ in misses.values()))
+    else:
+        rendered = [render(*inputs) for render, (inputs, _) in zip(renderers, misses.values())]
+
+    cache = highlight.get_cache()
+    for (key, (inputs, pending)), (highlighted, seconds) in zip(misses.items(), rendered):
+        highlight.record_render(inputs[1], inputs[2], highlighted, seconds)
+        if isinstance(highlighted, list):
+            for snippet in pending:
+                snippet.rendered_chunks = highlighted
+            continue
+        cache.set(key, highlighted)
+        for snippet in pending:
+            snippet.highlighted = highlighted
+            snippet.render_status = Snippet.RENDER_DONE
+
+
+def call(render, inputs):
+    """在进程池中执行`render(*inputs)`，`executor.map()`只能传入模块级的函数"""
+    return render(*inputs)
+
+
+def store_highlighted(snippets):
+    """把一批代码段的高亮结果一次写入`Blob`表，代替逐条`Snippet.store_highlighted()`"""
+    pending = []
+    for snippet in snippets:
+        if snippet.highlighted:
+            pending.append(snippet)
+        else:
+            snippet.highlighted_blob = None
+    for snippet, blob in zip(pending, Blob.objects.store_many([snippet.highlighted for snippet in pending])):
+        snippet.highlighted_blob = blob
+
+
+def store_chunks(snippets):
+    """把`render_all()`逐块渲染的结果写入`HighlightChunk`表，代码段必须已经保存"""
+    HighlightChunk.objects.replace({snippet.pk: snippet.rendered_chunks for snippet in snippets
+                                    if snippet.rendered_chunks is not None})
+
+
+def rerender(snippets, executor=None):
+    """重新渲染一批已经保存的代码段并回写，返回实际更新的行数
+
+    只回写`render_fingerprint`仍然和读取时相同的行，渲染期间被修改过的代码段由那次保存负责渲染。"""
+    previous = [snippet.render_fingerprint for snippet in snippets]
+    # 这些代码段之前逐块保存的结果需要替换或删除
+    chunked = {snippet.pk for snippet in snippets if snippet.render_status == Snippet.RENDER_CHUNKED}
+    render_all(snippets, executor)
+    store_highlighted(snippets)
+    groups = defaultdict(list)
+    for snippet, fingerprint in zip(snippets, previous):
+        groups[fingerprint, snippet.render_fingerprint, snippet.highlighted_blob_id,
+               snippet.render_status].append(snippet.pk)
+
+    now = timezone.now()
+    updated = 0
+    with transaction.atomic():
+        for (previous, fingerprint, blob, render_status), pks in groups.items():
+            updated += Snippet.objects.filter(pk__in=pks, render_fingerprint=previous).update(
+                highlighted_blob=blob, render_fingerprint=fingerprint, render_status=render_status, updated=now,
+            )
+        chunks = {snippet.pk: snippet.rendered_chunks or [] for snippet in snippets
+                  if snippet.rendered_chunks is not None or snippet.pk in chunked}
+        if chunks:
+            # 只替换回写成功的行，即指纹与这次渲染相同的行
+            rendered = {snippet.pk: snippet.render_fingerprint for snippet in snippets}
+            current = Snippet.objects.filter(pk__in=list(chunks)).values_list('pk', 'render_fingerprint')
+            HighlightChunk.objects.replace({pk: chunks[pk] for pk, fingerprint in current
+                                            if fingerprint == rendered[pk]})
+        response_cache.snippets_changed([snippet.pk for snippet in snippets])
+    return updated
+
+
+def import_snippets(items, owner, serializer_class, context=None, batch_size=None):
+    """验证并插入`items`中的代码段（可以是任意可迭代对象，包括生成器）
+
+    返回`(created, errors)`，`errors`是`{'index': 条目序号, 'errors': 验证错误}`的列表。
+    条目是`ParseError`时（NDJSON中无法解析的行，见`snippets.parsers.NDJSONParser`）记录为该条目的错误。"""
+    batch_size = batch_size or snippets_setting('BULK_BATCH_SIZE')
+    created = 0
+    errors = []
+    batch = []
+
+    def flush():
+        render_all(batch)
+        with transaction.atomic():
+            store_highlighted(batch)
+            Snippet.objects.bulk_create(batch, batch_size=batch_size)
+            store_chunks(batch)
+            search.index_snippets(batch)
+            response_cache.snippets_changed([], owners=[owner.pk])
+        batch.clear()
+
+    for index, item in enumerate(items):
+        if isinstance(item, ParseError):
+            errors.append({'index': index, 'errors': {api_settings.NON_FIELD_ERRORS_KEY: [item.detail]}})
+            continue
+        serializer = serializer_class(data=item, context=context)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'errors': serializer.errors})
+            continue
+        batch.append(Snippet(owner=owner, **serializer.validated_data))
+        if len(batch) >= batch_size:
+            created += len(batch)
+            flush()
+    if batch:
+        created += len(batch)
+        flush()
+    return created, errors
@@ -0,0 +1,43 @@
+"""
+代码段的语言和样式选项表
+
+遍历`get_all_lexers()`和`get_all_styles()`会扫描所有的Pygments插件（entry points），
+每个进程启动时都要花费几百毫秒。所以选项表预先生成在`snippets/pygments_tables.py`中，
+只有当其中记录的Pygments版本与当前安装的版本不一致时才在运行时重新扫描。
+
+升级Pygments后执行`python manage.py build_pygments_tables`重新生成。
+"""
+import logging
+
+import pygments
+
+logger = logging.getLogger(__name__)
+
+
+def build_tables():
+    """扫描已安装的Pygments，返回`(LANGUAGE_CHOICES, STYLE_CHOICES)`"""
+    from pygments.lexers import get_all_lexers
+    from pygments.styles import get_all_styles
+
+    lexers = [item for item in get_all_lexers() if item[1]]
+    language_choices = sorted([(item[1][0], item[0]) for item in lexers])
+    style_choices = sorted([(item, item) for item in get_all_styles()])
+    return language_choices, style_choices
+
+
+def load_tables():
+    """优先使用预先生成的选项表，版本不一致或不存在时回退到运行时扫描"""
+    try:
+        from . import pygments_tables
+    except ImportError:
+        pygments_tables = None
+    if pygments_tables is not None and pygments_tables.PYGMENTS_VERSION == pygments.__version__:
+        return pygments_tables.LANGUAGE_CHOICES, pygments_tables.STYLE_CHOICES
+    logger.warning(
+        'snippets/pygments_tables.py does not match Pygments %s, scanning lexers and styles at startup; '
+        'run `manage.py build_pygments_tables` to regenerate it.', pygments.__version__,
+    )
+    return build_tables()
+
+
+LANGUAGE_CHOICES, STYLE_CHOICES = load_tables()
@@ -0,0 +1,57 @@
+"""
+内容寻址存储使用的压缩编码
+
+压缩后的数据第一个字节标明编码方式，所以解压时不需要额外的字段，更换`SNIPPETS['BLOB_CODEC']`后
+旧数据仍然可以读取。摘要根据压缩前的内容计算，与编码方式无关。
+"""
+import hashlib
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .conf import snippets_setting
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW = b'n'
+ZLIB = b'z'
+ZSTD = b's'
+
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def encode(text):
+    """按配置的编码方式和压缩级别压缩`text`"""
+    data = text.encode('utf-8')
+    codec = snippets_setting('BLOB_CODEC')
+    level = snippets_setting('BLOB_COMPRESSION_LEVEL')
+    if codec == 'zlib':
+        return ZLIB + zlib.compress(data, level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured("SNIPPETS['BLOB_CODEC'] = 'zstd' requires the zstandard package "
+                                       "(pipenv install --categories speedups).")
+        return ZSTD + zstandard.ZstdCompressor(level=level).compress(data)
+    if codec is None:
+        return RAW + data
+    raise ImproperlyConfigured(f"Unknown SNIPPETS['BLOB_CODEC']: {codec!r}")
+
+
+def decode(payload):
+    payload = bytes(payload)
+    codec, data = payload[:1], payload[1:]
+    if codec == ZLIB:
+        data = zlib.decompress(data)
+    elif codec == ZSTD:
+        if zstandard is None:
+            raise ImproperlyConfigured('Decoding zstd blobs requires the zstandard package '
+                                       '(pipenv install --categories speedups).')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec != RAW:
+        raise ValueError(f'Unknown blob codec {codec!r}')
+    return data.decode('utf-8')
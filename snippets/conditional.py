@@ -0,0 +1,121 @@
+"""
+视图集的条件请求支持
+
+客户端带上`If-None-Match`/`If-Modified-Since`重新验证时，只需要一次很小的查询算出验证器（validators），
+验证器没有变化就直接返回304，不再查询完整数据、序列化和渲染。
+写操作（PUT/PATCH/DELETE）带上`If-Match`时可以实现乐观并发控制，验证器已经变化时返回412。
+检查和写入在同一个事务中执行，期间锁定要修改的行。
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import permissions
+
+
+def make_etag(*parts):
+    """根据任意可`repr`的部分生成一个强ETag"""
+    return '"%s"' % hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+class ConditionalMixin:
+    """为视图集的操作加上ETag/Last-Modified验证
+
+    子类实现`get_validators()`，根据`self.action`和`self.kwargs`返回`(etag, last_modified)`，
+    对象不存在时返回None，交给原来的操作处理（通常是404）。"""
+    # 写操作的前提条件
+    precondition_headers = ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def conditional(self, handler, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        etag, timestamp, response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if not self.keeps_validators(request, response):
+                return response
+        return self.set_validators(response, etag, timestamp)
+
+    def conditional_write(self, handler, request, *args, **kwargs):
+        """写操作的`conditional()`
+
+        没有前提条件时不需要验证器；否则检查和写入在同一个事务中，要修改的行被锁定，
+        并发的写操作不能在检查之后、写入之前修改它。行不存在时`If-Match`不成立，返回412。"""
+        if not any(header in request.META for header in self.precondition_headers):
+            return handler(request, *args, **kwargs)
+        model = self.get_queryset().model
+        with transaction.atomic(using=router.db_for_write(model)):
+            self.lock_object(model)
+            etag, timestamp, response = self.evaluate_preconditions(request, self.get_validators() or (None, None))
+            if response is None:
+                response = handler(request, *args, **kwargs)
+            return response
+
+    def lock_object(self, model):
+        """锁定`self.kwargs`指定的行，直到事务结束"""
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        try:
+            list(model._default_manager.select_for_update().filter(**lookup).values_list('pk'))
+        except (TypeError, ValueError, ValidationError):
+            pass
+
+    async def aget_validators(self):
+        return await sync_to_async(self.get_validators)()
+
+    async def aconditional(self, handler, request, *args, **kwargs):
+        """`conditional()`的异步版本，`handler`是协程函数，见`snippets.async_views`"""
+        validators = await self.aget_validators()
+        if validators is None:
+            return await handler(request, *args, **kwargs)
+
+        etag, timestamp, response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+            if not self.keeps_validators(request, response):
+                return response
+        return self.set_validators(response, etag, timestamp)
+
+    @staticmethod
+    def evaluate_preconditions(request, validators):
+        """返回`(etag, timestamp, response)`，验证器没有变化时`response`是304或412响应"""
+        etag, last_modified = validators
+        if etag is not None:
+            # 同一个URL可以协商出不同的表示（json、api等），ETag需要区分
+            etag = make_etag(etag, request.accepted_renderer.format)
+        timestamp = last_modified and int(last_modified.timestamp())
+        return etag, timestamp, get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+    @staticmethod
+    def keeps_validators(request, response):
+        # 写操作之后资源已经变化，原来的验证器不再有效
+        return request.method in permissions.SAFE_METHODS and response.status_code == 200
+
+    @staticmethod
+    def set_validators(response, etag, timestamp):
+        if etag is not None:
+            response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        # `partial_update`也通过`update`执行
+        return self.conditional_write(super().update, request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        return self.conditional_write(super().destroy, request, *args, **kwargs)
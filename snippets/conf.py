@@ -0,0 +1,77 @@
+"""
+`snippets`应用的配置项
+
+在项目settings中通过`SNIPPETS`字典覆盖默认值，例如：
+SNIPPETS = {
+    'HIGHLIGHT_CACHE_ALIAS': 'default',
+}
+每次读取时都会重新查找`settings.SNIPPETS`，因此测试中的`override_settings`可以直接生效
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    # 进程内高亮结果LRU缓存的内存上限（字节）
+    'HIGHLIGHT_CACHE_MAX_BYTES': 32 * 1024 * 1024,
+    # 共享缓存层使用的Django缓存别名，None表示只使用进程内缓存
+    'HIGHLIGHT_CACHE_ALIAS': None,
+    # 共享缓存层中条目的过期时间（秒）
+    'HIGHLIGHT_CACHE_TIMEOUT': 24 * 60 * 60,
+    # 超过该大小（字节）的代码逐块渲染保存，不放入高亮缓存，读取时逐块输出，None表示不限制
+    'HIGHLIGHT_MAX_BYTES': 1024 * 1024,
+    # 为True时在后台进程池中渲染高亮，保存请求不再等待渲染完成
+    'ASYNC_HIGHLIGHT': False,
+    # 后台渲染进程池的worker数量，None表示使用CPU核数
+    'HIGHLIGHT_WORKERS': None,
+    # 批量导入时每一批的条目数，每一批在一个事务中插入
+    'BULK_BATCH_SIZE': 500,
+    # 流式导出时每次从数据库读取的行数
+    'EXPORT_CHUNK_SIZE': 2000,
+    # 高亮结果的压缩方式：'zlib'、'zstd'（需要安装zstandard）或None（不压缩）
+    'BLOB_CODEC': 'zlib',
+    # 压缩级别，zlib为1~9，zstd为1~22
+    'BLOB_COMPRESSION_LEVEL': 6,
+    # JSON响应的编码库：None表示安装了orjson时使用orjson，也可以指定'orjson'或'json'
+    'JSON_BACKEND': None,
+    # 列表接口直接从`values()`生成响应数据，不经过序列化器，见`snippets.fastpath`
+    'FAST_LIST_SERIALIZATION': True,
+    # `list`、`retrieve`和`highlight`的读请求使用异步视图，见`snippets.async_views`，在加载URL配置时读取；
+    # WSGI下每个请求会多出同步/异步切换的开销，只应在用ASGI服务器部署时开启
+    'ASYNC_VIEWS': False,
+    # 匿名读请求的响应缓存使用的Django缓存别名，None表示不缓存，见`snippets.response_cache`
+    'RESPONSE_CACHE_ALIAS': None,
+    # 响应缓存条目的软过期时间（秒），之后只由一个请求重新生成
+    'RESPONSE_CACHE_TIMEOUT': 60,
+    # 软过期之后仍然可以使用旧响应的时间（秒）
+    'RESPONSE_CACHE_STALE_SECONDS': 30,
+    # 重新生成响应时持有锁的最长时间（秒），也是其他请求等待的最长时间
+    'RESPONSE_CACHE_LOCK_SECONDS': 5,
+    # 只读副本的数据库别名，安全方法的请求从副本读取，见`snippets.db_routers`
+    'READ_REPLICAS': [],
+    # 选择副本的策略：'round_robin'或'random'
+    'REPLICA_POLICY': 'round_robin',
+    # 写请求之后这个客户端的读请求继续使用主库的时间（秒），
+    # 实际使用的值不短于`REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_SECONDS`，见`snippets.db_routers.sticky_seconds`
+    'REPLICA_STICKY_SECONDS': 15,
+    # 副本落后主库超过该值（秒）时不再使用，None表示不检查
+    'REPLICA_MAX_LAG_SECONDS': 10,
+    # 返回副本延迟（秒）的函数，参数是数据库别名
+    'REPLICA_LAG_FUNCTION': 'snippets.db_routers.replica_lag',
+    # 副本延迟和可用性的检查结果复用的时间（秒）
+    'REPLICA_LAG_CHECK_SECONDS': 5,
+    # 用cProfile采样的请求比例，0表示不采样
+    'PROFILE_SAMPLE_RATE': 0,
+    # 采样的请求耗时超过该值（秒）时保存profile
+    'PROFILE_SLOW_SECONDS': 1.0,
+    # 保存profile的目录，None表示不保存
+    'PROFILE_DIR': None,
+    # 可以不登录读取`/metrics`的客户端IP（例如Prometheus），其他请求只有staff用户可以读取
+    'METRICS_ALLOWED_IPS': [],
+}
+
+
+def snippets_setting(name):
+    """返回配置项`name`的值，未配置时使用默认值"""
+    user_settings = getattr(settings, 'SNIPPETS', {})
+    if name in user_settings:
+        return user_settings[name]
+    return DEFAULTS[name]
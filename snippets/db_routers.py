@@ -0,0 +1,182 @@
+"""
+读写分离的数据库路由
+
+在`DATABASE_ROUTERS`中加入`ReplicaRouter`，在`MIDDLEWARE`中加入`snippets.middleware.ReplicaMiddleware`，
+再把只读副本的数据库别名写入`SNIPPETS['READ_REPLICAS']`：
+- 安全方法（GET/HEAD/OPTIONS）的请求从副本读取，同一个请求只选择一次副本（`REPLICA_POLICY`），
+  分页、计数和条件请求的验证器看到的是同一份数据
+- 写请求、请求之外的代码（后台渲染、管理命令）以及事务中的查询使用主库`default`
+- 读己之写：写请求成功后设置`PIN_COOKIE`，`sticky_seconds()`秒内这个客户端的读请求仍然使用主库
+- `REPLICA_LAG_FUNCTION`返回副本落后主库的秒数，超过`REPLICA_MAX_LAG_SECONDS`或连接失败的副本
+  在`REPLICA_LAG_CHECK_SECONDS`秒内不再使用，没有可用的副本时退回主库
+
+请求的路由状态保存在contextvar中，异步视图通过`sync_to_async`执行的查询也会继承。
+本地可以用多个SQLite文件模拟副本，由`python manage.py sync_sqlite_replicas`从主库复制。
+"""
+import contextvars
+import itertools
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+from .conf import snippets_setting
+
+logger = logging.getLogger(__name__)
+
+# 写请求成功后设置的cookie，有这个cookie的读请求使用主库
+PIN_COOKIE = 'snippets_primary'
+
+
+class ReplicaState:
+    """一个可以读副本的请求，`alias`是第一次读查询时选定的数据库"""
+    __slots__ = ('alias',)
+
+    def __init__(self):
+        self.alias = None
+
+
+# None表示使用主库
+_state = contextvars.ContextVar('snippets_replica_state', default=None)
+_counter = itertools.count()
+# 副本别名 -> (下次检查的时间, 是否可用)
+_checked = {}
+
+
+@contextmanager
+def read_from_replicas():
+    """范围内的读查询可以使用副本"""
+    token = _state.set(ReplicaState())
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """范围内的读查询使用主库，用于需要最新数据的读取"""
+    token = _state.set(None)
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def round_robin(replicas):
+    return replicas[next(_counter) % len(replicas)]
+
+
+POLICIES = {
+    'round_robin': round_robin,
+    'random': random.choice,
+}
+
+
+def replica_lag(alias):
+    """副本落后主库的秒数，无法判断时返回None；副本不可用时抛出异常
+
+    PostgreSQL使用流复制的回放时间，SQLite文件副本使用主库和副本文件的修改时间之差。"""
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+            )
+            lag = cursor.fetchone()[0]
+        # 不是备库时返回NULL
+        return float(lag or 0)
+    if connection.vendor == 'sqlite':
+        replica = connection.settings_dict['NAME']
+        # 连接不存在的文件会创建一个空数据库，所以先检查
+        if not os.path.isfile(replica):
+            raise FileNotFoundError(replica)
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        if not os.path.isfile(primary):
+            return None
+        return max(0.0, os.path.getmtime(primary) - os.path.getmtime(replica))
+    connection.ensure_connection()
+    return None
+
+
+def is_available(alias):
+    try:
+        lag = import_string(snippets_setting('REPLICA_LAG_FUNCTION'))(alias)
+    except Exception:
+        logger.warning('Read replica %s is unavailable', alias, exc_info=True)
+        return False
+    max_lag = snippets_setting('REPLICA_MAX_LAG_SECONDS')
+    if lag is not None and max_lag is not None and lag > max_lag:
+        logger.warning('Read replica %s is %.1f seconds behind', alias, lag)
+        return False
+    return True
+
+
+def sticky_seconds():
+    """写请求之后继续使用主库的时间，不短于可用副本可能落后的时间
+
+    副本的延迟最多是`REPLICA_MAX_LAG_SECONDS`，检查结果还会再复用`REPLICA_LAG_CHECK_SECONDS`，
+    `REPLICA_STICKY_SECONDS`更短时客户端可能在副本上读不到自己刚写入的数据"""
+    sticky = snippets_setting('REPLICA_STICKY_SECONDS')
+    max_lag = snippets_setting('REPLICA_MAX_LAG_SECONDS')
+    if max_lag is None:
+        return sticky
+    return max(sticky, max_lag + snippets_setting('REPLICA_LAG_CHECK_SECONDS'))
+
+
+def available_replicas():
+    """当前可用的副本，检查结果在`REPLICA_LAG_CHECK_SECONDS`内复用"""
+    now = time.monotonic()
+    replicas = []
+    for alias in snippets_setting('READ_REPLICAS'):
+        checked = _checked.get(alias)
+        if checked is None or checked[0] <= now:
+            checked = _checked[alias] = (now + snippets_setting('REPLICA_LAG_CHECK_SECONDS'), is_available(alias))
+        if checked[1]:
+            replicas.append(alias)
+    return replicas
+
+
+def reset_checks():
+    _checked.clear()
+
+
+def choose_database():
+    replicas = available_replicas()
+    if not replicas:
+        return DEFAULT_DB_ALIAS
+    return POLICIES[snippets_setting('REPLICA_POLICY')](replicas)
+
+
+class ReplicaRouter:
+    """`SNIPPETS['READ_REPLICAS']`为空时不做任何路由"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not snippets_setting('READ_REPLICAS'):
+            return None
+        # 事务中读到的必须是事务自己的数据
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            state.alias = choose_database()
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        # 从副本读出的对象保存时也写入主库，Django默认会写回对象所在的数据库
+        return DEFAULT_DB_ALIAS if snippets_setting('READ_REPLICAS') else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *snippets_setting('READ_REPLICAS')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本的结构和数据都从主库复制
+        return False if db in snippets_setting('READ_REPLICAS') else None
@@ -0,0 +1,93 @@
+"""
+流式导出代码段
+
+使用服务端迭代器（`QuerySet.iterator()`）分块读取，每读取一行就编码输出一行，
+内存占用与表的大小无关。客户端可以用`fields`选择输出的字段，例如不导出很大的`highlighted`。
+逐块保存的超大代码段的`highlighted`由各块拼接而成，每个这样的代码段多一次查询。
+"""
+import csv
+
+from .compression import decode
+from .models import HighlightChunk, Snippet
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+from rest_framework.exceptions import ValidationError
+
+# 导出字段到查询字段的对应关系
+EXPORT_FIELDS = {
+    'id': 'id',
+    'created': 'created',
+    'updated': 'updated',
+    'owner': 'owner__username',
+    'title': 'title',
+    'code': 'code',
+    'linenos': 'linenos',
+    'language': 'language',
+    'style': 'style',
+    'render_status': 'render_status',
+    # 高亮结果压缩保存，输出前解压，见`snippets.compression`
+    'highlighted': 'highlighted_blob__data',
+}
+DEFAULT_EXPORT_FIELDS = [name for name in EXPORT_FIELDS if name != 'highlighted']
+
+
+def parse_fields(value):
+    """解析以逗号分隔的字段列表，为空时使用默认字段"""
+    if not value:
+        return DEFAULT_EXPORT_FIELDS
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in EXPORT_FIELDS]
+    if unknown:
+        raise ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}.'})
+    return fields
+
+
+def iter_rows(queryset, fields, chunk_size):
+    columns = [EXPORT_FIELDS[name] for name in fields]
+    if 'highlighted' not in fields:
+        return queryset.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+    # 逐块保存的代码段（见`snippets.models.HighlightChunk`）还需要主键和是否显示行号，输出前去掉这几列
+    rows = queryset.order_by('pk').values_list(*columns, 'pk', 'render_status', 'linenos').iterator(
+        chunk_size=chunk_size)
+    index = fields.index('highlighted')
+    return (row[:index] + (highlighted(row[index], *row[-3:]),) + row[index + 1:-3] for row in rows)
+
+
+def highlighted(data, pk, render_status, linenos):
+    if render_status == Snippet.RENDER_CHUNKED:
+        return HighlightChunk.objects.fragment(pk, linenos)
+    return decode(data) if data is not None else ''
+
+
+def stream_ndjson(queryset, fields, chunk_size):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in iter_rows(queryset, fields, chunk_size):
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+class Echo:
+    """`csv.writer`需要的类文件对象，`write`直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, fields, chunk_size):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in iter_rows(queryset, fields, chunk_size):
+        yield writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+
+
+class NDJSONRenderer(renderers.JSONRenderer):
+    """只用于内容协商（`?format=ndjson`或`Accept: application/x-ndjson`），
+    导出内容由`stream_ndjson`生成，这个渲染器只会用来输出错误信息"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(renderers.JSONRenderer):
+    """同`NDJSONRenderer`，导出内容由`stream_csv`生成"""
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,126 @@
+"""
+列表接口的只读快速路径
+
+`HyperlinkedModelSerializer`为每一行的每个字段调用`to_representation`，
+超链接字段还要为每一行调用一次`reverse()`，每页数量较大时这部分Python开销占了列表接口的大部分耗时。
+快速路径只用`values()`查询需要的列，超链接由每个请求只`reverse()`一次得到的URL模板拼接，
+输出与对应的序列化器完全相同，`snippets.tests.FastPathTests`逐字节比较两者的响应。
+
+修改`SnippetModelSerializer`或`UserModelSerializer`的字段时需要同步修改这里。
+"""
+from collections import defaultdict
+
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+
+from . import metrics
+from .conf import snippets_setting
+from .models import Snippet
+
+# 不会出现在真实主键中的占位符，`reverse()`之后替换为每一行的主键
+PLACEHOLDER = 'pk-placeholder'
+
+
+def url_builder(view_name, request, format=None):
+    """只调用一次`reverse()`，返回根据主键生成URL的函数"""
+    url = reverse(view_name, kwargs={'pk': PLACEHOLDER}, request=request, format=format)
+    prefix, suffix = url.split(PLACEHOLDER)
+    return lambda pk: f'{prefix}{pk}{suffix}'
+
+
+class ValuesSerializer:
+    """把`values()`查询得到的字典转换成与超链接序列化器相同的表示"""
+    # `values()`查询的列，包括分页需要的排序字段
+    columns = ()
+
+    def __init__(self, request, format=None):
+        self.request = request
+        self.format = format
+
+    def prepare(self, queryset):
+        return queryset.values(*self.columns)
+
+    def to_representation(self, rows):
+        raise NotImplementedError
+
+    def data(self, rows):
+        with metrics.SERIALIZER_SECONDS.time(serializer=type(self).__name__, many=True):
+            return self.to_representation(rows)
+
+    async def adata(self, rows):
+        """异步视图使用，`rows`是已经取出的一页数据，需要额外查询的子类在这里使用异步ORM"""
+        return self.data(rows)
+
+
+class SnippetValuesSerializer(ValuesSerializer):
+    """对应`SnippetModelSerializer`"""
+    columns = ('id', 'created', 'title', 'owner__username', 'code', 'linenos', 'language', 'style',
+               'render_status')
+
+    def to_representation(self, rows):
+        detail = url_builder('snippet-detail', self.request, self.format)
+        # 与`highlight`字段的`format='html'`相同：有格式后缀时改用`.html`
+        highlight = url_builder('snippet-highlight', self.request, self.format and 'html')
+        return [{
+            'url': detail(row['id']),
+            'id': row['id'],
+            'highlight': highlight(row['id']),
+            'title': row['title'],
+            'owner': row['owner__username'],
+            'code': row['code'],
+            'linenos': row['linenos'],
+            'language': row['language'],
+            'style': row['style'],
+            'render_status': row['render_status'],
+        } for row in rows]
+
+
+class UserValuesSerializer(ValuesSerializer):
+    """对应`UserModelSerializer`"""
+    columns = ('id', 'username')
+
+    def prepare(self, queryset):
+        # 代码段链接在得到这一页的用户之后再一次查询
+        return super().prepare(queryset.prefetch_related(None))
+
+    @staticmethod
+    def snippet_links(rows):
+        # 与预先查询`snippets`时的顺序相同，即`Snippet.Meta.ordering`
+        return Snippet.objects.filter(owner__in=[row['id'] for row in rows]).values_list('owner', 'pk')
+
+    def to_representation(self, rows, snippets=None):
+        rows = list(rows)
+        if snippets is None:
+            snippets = defaultdict(list)
+            for owner, pk in self.snippet_links(rows):
+                snippets[owner].append(pk)
+        detail = url_builder('user-detail', self.request, self.format)
+        snippet = url_builder('snippet-detail', self.request, self.format)
+        return [{
+            'url': detail(row['id']),
+            'id': row['id'],
+            'username': row['username'],
+            'snippets': [snippet(pk) for pk in snippets[row['id']]],
+        } for row in rows]
+
+    async def adata(self, rows):
+        snippets = defaultdict(list)
+        async for owner, pk in self.snippet_links(rows):
+            snippets[owner].append(pk)
+        with metrics.SERIALIZER_SECONDS.time(serializer=type(self).__name__, many=True):
+            return self.to_representation(rows, snippets)
+
+
+class FastListMixin:
+    """`list`操作使用`values_serializer_class`代替序列化器，可以用`SNIPPETS['FAST_LIST_SERIALIZATION']`关闭"""
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if not snippets_setting('FAST_LIST_SERIALIZATION'):
+            return super().list(request, *args, **kwargs)
+        serializer = self.values_serializer_class(request, self.format_kwarg)
+        queryset = serializer.prepare(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.data(page))
+        return Response(serializer.data(queryset))
@@ -0,0 +1,46 @@
+from django.utils.dateparse import parse_datetime
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from . import search
+
+
+class SnippetFilterBackend(filters.BaseFilterBackend):
+    """按所有者用户名、语言、样式和创建时间范围过滤代码段
+
+    例如`/snippets/?owner=alice&language=python&created_after=2019-07-01T00:00:00Z`"""
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if params.get('owner'):
+            queryset = queryset.filter(owner__username=params['owner'])
+        if params.get('language'):
+            queryset = queryset.filter(language=params['language'])
+        if params.get('style'):
+            queryset = queryset.filter(style=params['style'])
+        if params.get('created_after'):
+            queryset = queryset.filter(created__gte=self.parse_datetime(params, 'created_after'))
+        if params.get('created_before'):
+            queryset = queryset.filter(created__lt=self.parse_datetime(params, 'created_before'))
+        return queryset
+
+    @staticmethod
+    def parse_datetime(params, name):
+        try:
+            value = parse_datetime(params[name])
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError({name: 'Enter a valid ISO 8601 date/time.'})
+        return value
+
+
+class SnippetSearchFilter(filters.BaseFilterBackend):
+    """全文搜索标题和代码，结果按相关度排序，例如`/snippets/?search=hello+wor*&language=python`"""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search.search(queryset, query)
@@ -0,0 +1,358 @@
+"""
+使用`pygments`渲染代码高亮，并按内容寻址缓存渲染结果
+
+缓存键是渲染输入（code, language, style, linenos）加上Pygments版本和渲染器版本的哈希，
+所以内容完全相同的代码段只需要渲染一次。缓存分为两层：
+1. 进程内LRU缓存，按占用内存限制大小
+2. 可选的共享缓存，使用Django的缓存框架，由`SNIPPETS['HIGHLIGHT_CACHE_ALIAS']`指定
+
+渲染结果只是高亮的HTML片段（`<div class="highlight">...</div>`），不包含样式表。
+每种样式的CSS由`style_css()`生成一次，响应时再用`render_page()`把片段包装成完整的HTML文档。
+
+超过`SNIPPETS['HIGHLIGHT_MAX_BYTES']`的代码保存时由`render_chunks()`每`STREAM_CHUNK_LINES`行渲染成一块，
+分别保存（见`snippets.models.HighlightChunk`），读取时`stream_chunks()`只取出需要的块，不再做词法分析。
+其他代码段请求某个行范围时由`stream_fragment()`从token流格式化，只格式化这些行。
+"""
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import pygments
+from django.core.cache import caches
+from django.test.signals import setting_changed
+from django.utils.html import escape
+from pygments import format, highlight
+from pygments.formatters.html import DOC_FOOTER, DOC_HEADER_EXTERNALCSS, HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+from . import metrics
+from .conf import snippets_setting
+
+# 修改渲染方式（格式化参数、输出结构等）时递增，使旧的缓存条目和已保存的结果失效
+RENDERER_VERSION = 2
+# 流式输出时每次格式化的行数，也是超大代码段保存的每一块的行数，修改时需要递增`RENDERER_VERSION`
+STREAM_CHUNK_LINES = 500
+# 逐块保存的代码段请求的行范围不超过这个行数时直接生成页面（可以放入响应缓存），更大的范围和整页一样流式输出
+MAX_BUFFERED_LINES = 4 * STREAM_CHUNK_LINES
+
+
+def render_key(code, language, style, linenos):
+    """返回渲染输入的十六进制哈希，作为内容寻址的缓存键"""
+    digest = hashlib.sha256()
+    parts = (pygments.__version__, str(RENDERER_VERSION), language, style,
+             linenos and '1' or '0', code)
+    for part in parts:
+        data = part.encode('utf-8')
+        # 加上长度前缀，避免不同的输入拼接后产生相同的字节串
+        digest.update(b'%d:' % len(data))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_lexer(language):
+    """按语言缓存lexer实例，lexer模块在第一次使用时才导入"""
+    return get_lexer_by_name(language)
+
+
+@lru_cache(maxsize=None)
+def get_formatter(style, linenos):
+    """按(style, linenos)缓存formatter实例"""
+    # linenos为True时得到'table'，为False时得到False
+    linenos = linenos and 'table' or False
+    return HtmlFormatter(style=style, linenos=linenos)
+
+
+def render(code, language, style, linenos):
+    """不经过缓存，直接用`pygments`生成高亮显示的HTML片段"""
+    return highlight(code, get_lexer(language), get_formatter(style, linenos))
+
+
+def is_oversized(code):
+    """代码超过`SNIPPETS['HIGHLIGHT_MAX_BYTES']`时保存时不渲染，读取时流式输出"""
+    max_bytes = snippets_setting('HIGHLIGHT_MAX_BYTES')
+    return max_bytes is not None and len(code) > max_bytes // 4 and len(code.encode('utf-8')) > max_bytes
+
+
+@lru_cache(maxsize=None)
+def get_line_lexer(language):
+    """不去掉开头和结尾空行的lexer，按行输出时行号才与源代码一致"""
+    return get_lexer_by_name(language, stripnl=False)
+
+
+@lru_cache(maxsize=None)
+def get_line_formatter(style):
+    """只输出每一行的内容，外层的`<div><pre>`和行号由`stream_fragment()`生成"""
+    return HtmlFormatter(style=style, nowrap=True)
+
+
+def count_lines(code):
+    return code.count('\n') + (not code.endswith('\n'))
+
+
+def split_lines(tokens):
+    """把token流按行切分，每次产生一行的token列表"""
+    line = []
+    for ttype, value in tokens:
+        *complete, rest = value.split('\n')
+        for part in complete:
+            line.append((ttype, part + '\n'))
+            yield line
+            line = []
+        if rest:
+            line.append((ttype, rest))
+    if line:
+        yield line
+
+
+def number_lines(html, first, width):
+    """在格式化后的每一行前加上行号，`first`是第一行的行号"""
+    # 每一行都以换行结束，不能用`splitlines()`，它还会在换页符等字符处分行
+    return ''.join(f'<span class="linenos">{number:>{width}}</span>{line}\n'
+                   for number, line in enumerate(html.split('\n')[:-1], first))
+
+
+def stream_fragment(code, language, style, linenos, start=1, end=None):
+    """逐块产生第`start`到`end`行（从1开始，包括`end`）的高亮片段，不在内存中生成整个片段
+
+    `start`之前的行只做词法分析以得到正确的lexer状态，不格式化；`end`之后的部分不会分析。
+    行号是行内的`<span class="linenos">`，表格形式的行号无法逐块输出。"""
+    end = min(end or count_lines(code), count_lines(code))
+    width = len(str(end))
+    formatter = get_line_formatter(style)
+
+    def format_chunk(lines, first):
+        html = format((token for line in lines for token in line), formatter)
+        return number_lines(html, first, width) if linenos else html
+
+    yield '<div class="highlight"><pre><span></span>'
+    chunk, first = [], start
+    for number, line in enumerate(split_lines(get_line_lexer(language).get_tokens(code)), 1):
+        if number > end:
+            break
+        if number < start:
+            continue
+        if not chunk:
+            first = number
+        chunk.append(line)
+        if len(chunk) >= STREAM_CHUNK_LINES:
+            yield format_chunk(chunk, first)
+            chunk = []
+    if chunk:
+        yield format_chunk(chunk, first)
+    yield '</pre></div>\n'
+
+
+def render_chunks(code, language, style):
+    """把代码每`STREAM_CHUNK_LINES`行格式化成一块，不包括行号和外层的`<div><pre>`，返回块的列表
+
+    整段代码只做一次词法分析，按行切分后与`stream_fragment()`的输出相同。"""
+    formatter = get_line_formatter(style)
+    chunks, lines = [], []
+    for line in split_lines(get_line_lexer(language).get_tokens(code)):
+        lines.append(line)
+        if len(lines) >= STREAM_CHUNK_LINES:
+            chunks.append(format((token for line in lines for token in line), formatter))
+            lines = []
+    if lines:
+        chunks.append(format((token for line in lines for token in line), formatter))
+    return chunks
+
+
+def stream_chunks(chunks, first, linenos, start, end):
+    """与`stream_fragment()`相同，但是从`render_chunks()`保存的块中切出第`start`到`end`行
+
+    `chunks`是包含这些行的连续若干块，`first`是第一块第一行的行号，`end`不能超过代码的总行数。"""
+    width = len(str(end))
+    yield '<div class="highlight"><pre><span></span>'
+    for chunk in chunks:
+        lines = chunk.split('\n')[:-1]
+        # 只在第一块和最后一块需要截取
+        if first < start or first + len(lines) - 1 > end:
+            skip = max(start - first, 0)
+            html = ''.join(f'{line}\n' for line in lines[skip:end - first + 1])
+            number = first + skip
+        else:
+            html, number = chunk, first
+        if html:
+            yield number_lines(html, number, width) if linenos else html
+        first += len(lines)
+    yield '</pre></div>\n'
+
+
+def timed_render(code, language, style, linenos):
+    """渲染并返回`(html, 耗时)`，可以在进程池的worker中执行，由调用方记录指标"""
+    start = time.perf_counter()
+    html = render(code, language, style, linenos)
+    return html, time.perf_counter() - start
+
+
+def timed_render_chunks(code, language, style, linenos):
+    """`render_chunks()`的`timed_render()`，参数与`timed_render()`相同，返回`(块的列表, 耗时)`"""
+    start = time.perf_counter()
+    chunks = render_chunks(code, language, style)
+    return chunks, time.perf_counter() - start
+
+
+def record_render(language, style, html, seconds):
+    """记录一次高亮渲染的耗时和输出大小，`html`是高亮片段或者`render_chunks()`的块的列表"""
+    size = sum(len(part.encode('utf-8')) for part in ([html] if isinstance(html, str) else html))
+    metrics.HIGHLIGHT_SECONDS.observe(seconds, language=language, style=style)
+    metrics.HIGHLIGHT_BYTES.observe(size, language=language, style=style)
+
+
+@lru_cache(maxsize=None)
+def style_css(style):
+    """返回样式`style`的CSS，每个进程中每种样式只生成一次"""
+    return HtmlFormatter(style=style).get_style_defs('.highlight')
+
+
+def page_header(title, css_url):
+    return DOC_HEADER_EXTERNALCSS % {'title': escape(title), 'cssfile': escape(css_url), 'encoding': 'utf-8'}
+
+
+def render_page(fragment, title, css_url):
+    """把高亮片段包装成引用外部样式表的完整HTML文档"""
+    return page_header(title, css_url) + fragment + DOC_FOOTER
+
+
+def stream_page(fragments, title, css_url):
+    """与`render_page()`相同，但`fragments`是`stream_fragment()`产生的片段"""
+    yield page_header(title, css_url)
+    yield from fragments
+    yield DOC_FOOTER
+
+
+class HighlightCache:
+    """两层的高亮结果缓存
+
+    进程内一层是按`sys.getsizeof`统计内存的LRU，超过`max_bytes`时淘汰最久未使用的条目；
+    `shared`是一个Django缓存后端，为None时不使用共享层。"""
+
+    def __init__(self, max_bytes, shared=None, timeout=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.timeout = timeout
+        self.current_bytes = 0
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return value
+        if self.shared is not None:
+            value = self.shared.get(self._shared_key(key))
+            if value is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._store_local(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._store_local(key, value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value, self.timeout)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _store_local(self, key, value):
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            # 单个结果就超过上限时不放入进程内缓存
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= sys.getsizeof(old)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= sys.getsizeof(evicted)
+
+    @staticmethod
+    def _shared_key(key):
+        return f'snippets:highlight:{key}'
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """返回按当前配置创建的进程级`HighlightCache`单例"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                alias = snippets_setting('HIGHLIGHT_CACHE_ALIAS')
+                _cache = HighlightCache(
+                    max_bytes=snippets_setting('HIGHLIGHT_CACHE_MAX_BYTES'),
+                    shared=alias and caches[alias] or None,
+                    timeout=snippets_setting('HIGHLIGHT_CACHE_TIMEOUT'),
+                )
+    return _cache
+
+
+def reset_cache():
+    """丢弃当前的缓存单例，下次使用时按最新配置重新创建"""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def reload_cache(*, setting, **kwargs):
+    if setting == 'SNIPPETS':
+        reset_cache()
+
+
+setting_changed.connect(reload_cache)
+
+
+def cache_stats():
+    """返回高亮缓存的命中/未命中计数"""
+    return get_cache().stats()
+
+
+def cached_lookup(code, language, style, linenos):
+    """只查询缓存，没有缓存过的渲染结果时返回None"""
+    return get_cache().get(render_key(code, language, style, linenos))
+
+
+def cached_render(code, language, style, linenos):
+    """返回高亮显示的HTML片段，优先使用缓存中内容相同的渲染结果"""
+    cache = get_cache()
+    key = render_key(code, language, style, linenos)
+    value = cache.get(key)
+    if value is None:
+        value, seconds = timed_render(code, language, style, linenos)
+        record_render(language, style, value, seconds)
+        cache.set(key, value)
+    return value
@@ -0,0 +1,129 @@
+import json
+import platform
+import random
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import django
+import pygments
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from snippets.benchmarks import run_scenario, seed
+from snippets.models import Snippet
+
+SCENARIOS = ('list', 'retrieve', 'highlight', 'create', 'update', 'delete')
+
+
+class Command(BaseCommand):
+    help = ('在临时的测试数据库中生成数据，通过Django测试客户端压测代码段和用户接口，'
+            '输出吞吐量、p50/p95/p99延迟、查询次数和峰值内存')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--snippets', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200, help='每个场景执行的请求数')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='以逗号分隔的场景名')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子，保证多次运行的数据相同')
+        parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+        parser.add_argument('--compare', help='与之前保存的结果比较p95延迟')
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help='p95延迟超过对比结果的这个倍数时以非零状态退出，例如1.2')
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options['scenarios'].split(',') if name]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(scenarios, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {'meta': self.meta(options), 'scenarios': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['compare']:
+            self.compare(results, options['compare'], options['max_regression'])
+
+    def run(self, scenarios, options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"Seeding {options['users']} users and {options['snippets']} snippets...")
+        owners = seed(options['users'], options['snippets'], seed=options['seed'])
+        pks = list(Snippet.objects.values_list('pk', flat=True))
+
+        anonymous = Client(HTTP_ACCEPT='application/json')
+        writer = Client(HTTP_ACCEPT='application/json')
+        writer.force_login(owners[0])
+        # 写操作只针对第一个用户自己的代码段
+        own = list(Snippet.objects.filter(owner=owners[0]).values_list('pk', flat=True))
+        page = {'page_size': options['page_size']}
+        body = json.dumps({'title': 'benchmark', 'code': 'print("benchmark")\n', 'language': 'python'})
+
+        def delete():
+            if not own:
+                response = writer.post('/snippets/', body, content_type='application/json')
+                own.append(response.json()['id'])
+            return writer.delete(f'/snippets/{own.pop()}/')
+
+        requests = {
+            'list': lambda: anonymous.get('/snippets/', page),
+            'retrieve': lambda: anonymous.get(f'/snippets/{rng.choice(pks)}/'),
+            'highlight': lambda: anonymous.get(f'/snippets/{rng.choice(pks)}/highlight/', HTTP_ACCEPT='text/html'),
+            'create': lambda: writer.post('/snippets/', body, content_type='application/json'),
+            'update': lambda: writer.patch(f'/snippets/{rng.choice(own)}/', body, content_type='application/json'),
+            'delete': delete,
+        }
+        results = {}
+        for name in scenarios:
+            results[name] = run_scenario(requests[name], options['requests'])
+            latency = results[name]['latency_ms']
+            self.stdout.write(
+                f"{name:<10} {results[name]['throughput_rps']:8.1f} req/s  p50 {latency['p50']:7.2f} ms  "
+                f"p95 {latency['p95']:7.2f} ms  p99 {latency['p99']:7.2f} ms  "
+                f"queries {results[name]['queries']['max']:>3}  peak {results[name]['peak_memory_kb']:9.1f} KiB  "
+                f"errors {results[name]['errors']}"
+            )
+        return results
+
+    def meta(self, options):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                      capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            revision = None
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': revision,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'django': django.get_version(),
+            'pygments': pygments.__version__,
+            'database': connection.vendor,
+            'options': {key: options[key] for key in ('users', 'snippets', 'requests', 'page_size', 'seed')},
+        }
+
+    def compare(self, results, path, max_regression):
+        with open(path) as f:
+            baseline = json.load(f)['scenarios']
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name]['latency_ms']['p95'], result['latency_ms']['p95']
+            ratio = before and after / before
+            self.stdout.write(f'{name:<10} p95 {before:7.2f} ms -> {after:7.2f} ms ({ratio:.2f}x)')
+            if max_regression is not None and ratio and ratio > max_regression:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f'p95 latency regressed more than {max_regression}x in: {", ".join(regressions)}')
@@ -0,0 +1,60 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from snippets.benchmarks import build_urlconf, request_mix, run_asgi, run_wsgi, seed
+from snippets.models import Snippet
+
+MODES = ('wsgi', 'asgi-sync', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ('在临时的测试数据库中生成数据，用大量并发的慢速客户端分别请求WSGI（线程池）、'
+            'ASGI+同步视图和ASGI+异步视图，比较吞吐量和延迟')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--snippets', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=600, help='每种模式执行的请求数')
+        parser.add_argument('--concurrency', type=int, default=100, help='同时连接的客户端数')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI服务器的worker线程数')
+        parser.add_argument('--client-delay', type=float, default=0.2,
+                            help='客户端接收每个响应的耗时（秒），模拟慢速网络')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--modes', default=','.join(MODES), help='以逗号分隔的模式名')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        modes = [name for name in options['modes'].split(',') if name]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(sorted(unknown))}')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(modes, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, modes, options):
+        self.stdout.write(f"Seeding {options['users']} users and {options['snippets']} snippets...")
+        seed(options['users'], options['snippets'], seed=options['seed'])
+        pks = list(Snippet.objects.values_list('pk', flat=True))
+        urls = request_mix(pks, options['requests'], options['page_size'], random.Random(options['seed']))
+
+        for mode in modes:
+            with override_settings(ROOT_URLCONF=build_urlconf(async_views=mode == 'asgi')):
+                if mode == 'wsgi':
+                    result = run_wsgi(urls, options['concurrency'], options['threads'], options['client_delay'])
+                else:
+                    result = run_asgi(urls, options['concurrency'], options['client_delay'])
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{mode:<10} {result['throughput_rps']:8.1f} req/s  p50 {latency['p50']:8.2f} ms  "
+                f"p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms  errors {result['errors']}"
+            )
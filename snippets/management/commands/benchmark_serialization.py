@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from snippets.benchmarks import run_scenario, seed
+from snippets.renderers import orjson
+
+# (名称, 是否使用快速路径, JSON编码库)
+VARIANTS = (
+    ('serializer+json', False, 'json'),
+    ('values+json', True, 'json'),
+    ('values+orjson', True, 'orjson'),
+)
+
+
+class Command(BaseCommand):
+    help = ('在临时的测试数据库中比较列表接口使用序列化器和`values()`快速路径、'
+            '标准库json和orjson时的延迟，并检查各种方式的响应完全相同')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--snippets', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200, help='每种方式执行的请求数')
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed(options['users'], options['snippets'])
+            for url in ('/snippets/', '/users/'):
+                self.run(url, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, url, options):
+        client = Client(HTTP_ACCEPT='application/json')
+        page = {'page_size': options['page_size']}
+        baseline = None
+        contents = set()
+        for name, fast, backend in VARIANTS:
+            if backend == 'orjson' and orjson is None:
+                self.stdout.write(f'{url:<10} {name:<16} skipped, orjson is not installed')
+                continue
+            with override_settings(SNIPPETS={'FAST_LIST_SERIALIZATION': fast, 'JSON_BACKEND': backend}):
+                contents.add(client.get(url, page).content)
+                result = run_scenario(lambda: client.get(url, page), options['requests'])
+            p50 = result['latency_ms']['p50']
+            baseline = baseline or p50
+            self.stdout.write(
+                f"{url:<10} {name:<16} p50 {p50:7.2f} ms  p95 {result['latency_ms']['p95']:7.2f} ms  "
+                f"queries {result['queries']['max']:>3}  speedup {baseline / p50:5.2f}x"
+            )
+        if len(contents) != 1:
+            # 非零退出码，CI和脚本可以发现
+            raise CommandError(f'{url} responses differ between variants.')
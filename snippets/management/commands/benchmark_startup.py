@@ -0,0 +1,65 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# 每个场景都在全新的解释器中运行，打印从解释器启动到场景结束的耗时
+SCENARIOS = {
+    # Web worker或manage.py启动时的主要开销：加载所有应用（包括snippets.models）
+    'django_setup': (
+        'import django\n'
+        'django.setup()\n'
+    ),
+    # 不使用预先生成的选项表时，每个进程额外需要的插件扫描
+    'scan_pygments_tables': (
+        'from snippets.choices import build_tables\n'
+        'build_tables()\n'
+    ),
+    # 使用预先生成的选项表
+    'load_pygments_tables': (
+        'from snippets import pygments_tables\n'
+        'pygments_tables.LANGUAGE_CHOICES, pygments_tables.STYLE_CHOICES\n'
+    ),
+}
+
+TEMPLATE = (
+    'import time\n'
+    'start = time.perf_counter()\n'
+    '{body}'
+    'print(time.perf_counter() - start)\n'
+)
+
+
+class Command(BaseCommand):
+    help = '在全新的进程中测量冷启动耗时，比较预先生成与运行时扫描Pygments选项表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help='每个场景启动的进程数')
+        parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+
+    def handle(self, *args, **options):
+        env = {'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE, 'PYTHONPATH': str(settings.BASE_DIR)}
+        results = {}
+        for name, body in SCENARIOS.items():
+            timings = []
+            for _ in range(options['repeat']):
+                output = subprocess.run(
+                    [sys.executable, '-c', TEMPLATE.format(body=body)],
+                    env=env, cwd=settings.BASE_DIR, check=True, capture_output=True, text=True,
+                ).stdout
+                timings.append(float(output.strip().splitlines()[-1]))
+            results[name] = {
+                'runs': len(timings),
+                'min_ms': min(timings) * 1000,
+                'median_ms': statistics.median(timings) * 1000,
+                'max_ms': max(timings) * 1000,
+            }
+            self.stdout.write(f"{name:<24} median {results[name]['median_ms']:8.1f} ms  "
+                              f"min {results[name]['min_ms']:8.1f} ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,33 @@
+import os
+
+import pygments
+from django.core.management.base import BaseCommand
+
+from snippets.choices import build_tables
+
+HEADER = '''"""
+由`python manage.py build_pygments_tables`生成，不要手动修改
+
+记录生成时Pygments版本下的语言和样式选项表，见`snippets/choices.py`
+"""
+'''
+
+
+class Command(BaseCommand):
+    help = '根据当前安装的Pygments重新生成snippets/pygments_tables.py'
+
+    def handle(self, *args, **options):
+        language_choices, style_choices = build_tables()
+        lines = [HEADER, f'\nPYGMENTS_VERSION = {pygments.__version__!r}\n', '\nLANGUAGE_CHOICES = [\n']
+        lines.extend(f'    {item!r},\n' for item in language_choices)
+        lines.append(']\n\nSTYLE_CHOICES = [\n')
+        lines.extend(f'    {item!r},\n' for item in style_choices)
+        lines.append(']\n')
+
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'pygments_tables.py')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(language_choices)} languages and {len(style_choices)} styles '
+            f'for Pygments {pygments.__version__} to {path}'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from snippets.models import Blob
+
+
+class Command(BaseCommand):
+    help = '删除已经没有代码段引用的高亮结果'
+
+    def handle(self, *args, **options):
+        count = Blob.objects.prune()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} unreferenced blobs.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from snippets import search
+
+
+class Command(BaseCommand):
+    help = '重建代码段的全文搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='要重建索引的数据库别名')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_supported(using):
+            raise CommandError(f'Database "{using}" does not use the SQLite FTS5 search index.')
+        with transaction.atomic(using=using):
+            count = search.rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} snippets.'))
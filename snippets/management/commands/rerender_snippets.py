@@ -0,0 +1,93 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.bulk import rerender
+from snippets.conf import snippets_setting
+from snippets.highlight import is_oversized, render_key
+from snippets.models import Snippet
+from snippets.tasks import get_executor
+
+# 判断是否需要重新渲染时只读取渲染输入，不读取高亮结果
+SCAN_FIELDS = ('pk', 'code', 'language', 'style', 'linenos', 'render_status', 'render_fingerprint')
+
+
+def is_stale(snippet):
+    if snippet.render_status == Snippet.RENDER_CHUNKED and not is_oversized(snippet.code):
+        # `HIGHLIGHT_MAX_BYTES`调大之后可以保存整个渲染结果
+        return True
+    # `streamed`是之前读取时才渲染的超大代码段，改为逐块保存
+    return (snippet.render_status not in (Snippet.RENDER_DONE, Snippet.RENDER_CHUNKED)
+            or snippet.render_fingerprint != render_key(*snippet.render_inputs()))
+
+
+class Command(BaseCommand):
+    help = ('找出渲染输入或Pygments/渲染器版本变化之后过期的高亮结果，在进程池中并行重新渲染并批量回写。'
+            '中断后可以用--resume从上次的位置继续')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="每批渲染和回写的数量，默认为SNIPPETS['BULK_BATCH_SIZE']")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="渲染进程数，默认为SNIPPETS['HIGHLIGHT_WORKERS']，即CPU核数")
+        parser.add_argument('--throttle', type=float, default=0, help='每批回写之后暂停的秒数，减轻数据库的压力')
+        parser.add_argument('--state-file', help='把进度（已经处理到的主键）写入该文件')
+        parser.add_argument('--resume', action='store_true', help='从--state-file记录的位置继续')
+        parser.add_argument('--dry-run', action='store_true', help='只统计过期的代码段，不重新渲染')
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['state_file']:
+            raise CommandError('--resume requires --state-file.')
+        batch_size = options['batch_size'] or snippets_setting('BULK_BATCH_SIZE')
+        last_pk = self.load_state(options['state_file']) if options['resume'] else 0
+
+        executor = None
+        if options['workers'] and not options['dry_run']:
+            executor = ProcessPoolExecutor(max_workers=options['workers'])
+        try:
+            scanned, stale, updated = self.run(last_pk, batch_size, executor, options)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        action = 'Found' if options['dry_run'] else 'Re-rendered'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {scanned} snippets. {action} {stale if options["dry_run"] else updated} stale snippets.'))
+
+    def run(self, last_pk, batch_size, executor, options):
+        queryset = Snippet.objects.only(*SCAN_FIELDS).order_by('pk')
+        scanned = stale = updated = 0
+        while True:
+            # 按主键分段读取，回写不影响后面的读取，中断后也可以从记录的主键继续
+            chunk = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not chunk:
+                return scanned, stale, updated
+            batch = [snippet for snippet in chunk if is_stale(snippet)]
+            scanned += len(chunk)
+            stale += len(batch)
+            last_pk = chunk[-1].pk
+            if batch and not options['dry_run']:
+                updated += rerender(batch, executor or get_executor())
+                if options['throttle']:
+                    time.sleep(options['throttle'])
+            if options['state_file'] and not options['dry_run']:
+                self.save_state(options['state_file'], last_pk)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Scanned {scanned}, stale {stale}, re-rendered {updated}, last pk {last_pk}')
+
+    @staticmethod
+    def load_state(path):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f)['last_pk']
+
+    @staticmethod
+    def save_state(path, last_pk):
+        # 先写临时文件再替换，中断时不会留下不完整的进度文件
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'last_pk': last_pk}, f)
+        os.replace(f'{path}.tmp', path)
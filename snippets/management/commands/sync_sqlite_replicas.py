@@ -0,0 +1,31 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from snippets.conf import snippets_setting
+
+
+class Command(BaseCommand):
+    help = '用SQLite的在线备份把主库复制到只读副本文件，用于在本地模拟读写分离，见snippets.db_routers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('databases', nargs='*', help="副本的数据库别名，默认为SNIPPETS['READ_REPLICAS']")
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or snippets_setting('READ_REPLICAS')
+        if not aliases:
+            raise CommandError("No replicas given and SNIPPETS['READ_REPLICAS'] is empty.")
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'Database "{alias}" is not SQLite.')
+        primary.ensure_connection()
+        for alias in aliases:
+            # 备份在目标文件上加锁逐页写入，已经打开的连接之后读到的就是新数据
+            target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f'Copied {DEFAULT_DB_ALIAS} to {alias}.'))
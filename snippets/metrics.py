@@ -0,0 +1,166 @@
+"""
+进程内的性能指标，以Prometheus文本格式在`/metrics`输出
+
+指标保存在当前进程中，多进程部署（例如多个gunicorn worker）时每个进程各自统计，
+抓取时可以通过worker各自的端口分别抓取，或者只把它当作单个进程的采样。
+
+记录的指标：
+- 每个视图操作的请求数、耗时、数据库查询次数和查询耗时（`snippets.middleware.MetricsMiddleware`）
+- 权限检查（`snippets.views.InstrumentedViewMixin`）、序列化（`snippets.serializers`）和渲染的耗时
+- 高亮渲染的耗时和输出大小，按语言和样式区分（`snippets.highlight`）
+- 响应缓存的命中情况（`snippets.response_cache`）
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus客户端默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+SIZE_BUCKETS = tuple(256 * 4 ** n for n in range(9))  # 256B ~ 16MiB
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self.expose_samples(items))
+        return lines
+
+    def expose_samples(self, items):
+        for labels, value in items:
+            yield f'{self.name}{format_labels(labels)} {value}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self.key(labels), 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        state = self._values.get(self.key(labels))
+        return state and {'sum': state['sum'], 'count': state['count']} or {'sum': 0, 'count': 0}
+
+    def expose_samples(self, items):
+        for labels, state in items:
+            for bound, count in zip(self.buckets, state['buckets']):
+                yield f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {count}'
+            yield f'{self.name}_bucket{format_labels(labels + (("le", "+Inf"),))} {state["count"]}'
+            yield f'{self.name}_sum{format_labels(labels)} {state["sum"]}'
+            yield f'{self.name}_count{format_labels(labels)} {state["count"]}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+REQUEST_LABELS = ('view', 'action', 'method')
+REQUESTS = REGISTRY.register(Counter(
+    'snippets_http_requests_total', 'HTTP requests by view action and status.', REQUEST_LABELS + ('status',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'snippets_http_request_duration_seconds', 'Time spent handling a request.', REQUEST_LABELS))
+DB_QUERIES = REGISTRY.register(Histogram(
+    'snippets_db_queries_per_request', 'Database queries executed per request.', REQUEST_LABELS, COUNT_BUCKETS))
+DB_SECONDS = REGISTRY.register(Histogram(
+    'snippets_db_duration_seconds', 'Time spent in database queries per request.', REQUEST_LABELS))
+PERMISSION_SECONDS = REGISTRY.register(Histogram(
+    'snippets_permission_check_duration_seconds', 'Time spent in permission checks.', ('view', 'action')))
+SERIALIZER_SECONDS = REGISTRY.register(Histogram(
+    'snippets_serializer_duration_seconds', 'Time spent building serializer data.', ('serializer', 'many')))
+RENDER_SECONDS = REGISTRY.register(Histogram(
+    'snippets_render_duration_seconds', 'Time spent rendering responses.', ('view', 'action', 'renderer')))
+HIGHLIGHT_SECONDS = REGISTRY.register(Histogram(
+    'snippets_highlight_duration_seconds', 'Time spent highlighting code with Pygments.', ('language', 'style')))
+HIGHLIGHT_BYTES = REGISTRY.register(Histogram(
+    'snippets_highlighted_bytes', 'Size of highlighted HTML fragments.', ('language', 'style'), SIZE_BUCKETS))
+HIGHLIGHT_CACHE = REGISTRY.register(Gauge(
+    'snippets_highlight_cache', 'Highlight cache counters of this process.', ('stat',)))
+RESPONSE_CACHE = REGISTRY.register(Counter(
+    'snippets_response_cache_total', 'Response cache lookups by result (hit, stale, wait, miss).', ('result',)))
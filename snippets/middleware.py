@@ -0,0 +1,171 @@
+import cProfile
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+
+from . import db_routers, metrics
+from .conf import snippets_setting
+
+
+class QueryRecorder:
+    """通过`connection.execute_wrapper`统计一个请求中的查询次数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def request_labels(request):
+    """根据解析到的视图得到指标的标签，DRF视图集使用视图集类名和操作名"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return {'view': 'unresolved', 'action': '', 'method': request.method}
+    view = getattr(match.func, 'cls', None) or match.func
+    actions = getattr(match.func, 'actions', None) or {}
+    return {
+        'view': getattr(view, '__name__', match.view_name),
+        'action': actions.get(request.method.lower(), match.url_name or ''),
+        'method': request.method,
+    }
+
+
+class MetricsMiddleware:
+    """记录每个请求的耗时、状态码、数据库查询次数和耗时，以及响应的渲染耗时
+
+    `SNIPPETS['PROFILE_SAMPLE_RATE']`大于0时按比例用cProfile采样请求，
+    耗时超过`SNIPPETS['PROFILE_SLOW_SECONDS']`的采样写入`SNIPPETS['PROFILE_DIR']`，
+    可以用`python -m pstats`或snakeviz查看。应放在MIDDLEWARE的最前面。
+
+    同时支持WSGI和ASGI，ASGI下不会让后面的中间件和异步视图退回同步模式。"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.record_queries(stack, recorder)
+            response = self.get_response(request)
+        self.finish(request, response, recorder, profiler, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        # `execute_wrapper`只对当前线程的连接生效，异步ORM和同步视图的查询都在请求专用的线程中执行
+        # （`thread_sensitive=True`），所以也在那个线程中安装
+        stack = ExitStack()
+        await sync_to_async(self.record_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.finish(request, response, recorder, profiler, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def record_queries(stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def finish(self, request, response, recorder, profiler, elapsed):
+        labels = request_labels(request)
+        metrics.REQUESTS.inc(status=response.status_code, **labels)
+        metrics.REQUEST_SECONDS.observe(elapsed, **labels)
+        metrics.DB_QUERIES.observe(recorder.count, **labels)
+        metrics.DB_SECONDS.observe(recorder.seconds, **labels)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= snippets_setting('PROFILE_SLOW_SECONDS'):
+                self.dump_profile(profiler, labels, elapsed)
+
+    def process_template_response(self, request, response):
+        # DRF的Response在所有中间件的`process_template_response`之后才渲染
+        labels = request_labels(request)
+        renderer = getattr(getattr(response, 'accepted_renderer', None), 'format', '')
+        start = time.perf_counter()
+
+        def rendered(response):
+            metrics.RENDER_SECONDS.observe(time.perf_counter() - start, renderer=renderer,
+                                           view=labels['view'], action=labels['action'])
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def start_profiler():
+        rate = snippets_setting('PROFILE_SAMPLE_RATE')
+        if not rate or not snippets_setting('PROFILE_DIR') or random.random() >= rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一线程中已经有其他profiler在运行
+            return None
+        return profiler
+
+    @staticmethod
+    def dump_profile(profiler, labels, elapsed):
+        directory = snippets_setting('PROFILE_DIR')
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{labels['view']}-{labels['action']}-{elapsed * 1000:.0f}ms.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+
+
+class ReplicaMiddleware:
+    """安全方法的请求可以从只读副本读取，写请求成功后把客户端固定到主库一段时间，见`snippets.db_routers`"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.routing(request):
+            response = self.get_response(request)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        with self.routing(request):
+            response = await self.get_response(request)
+        return self.pin(request, response)
+
+    @staticmethod
+    def routing(request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') and db_routers.PIN_COOKIE not in request.COOKIES:
+            return db_routers.read_from_replicas()
+        return db_routers.use_primary()
+
+    @staticmethod
+    def pin(request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+                and snippets_setting('READ_REPLICAS'):
+            response.set_cookie(db_routers.PIN_COOKIE, '1', max_age=db_routers.sticky_seconds(),
+                                httponly=True, samesite='Lax')
+        return response
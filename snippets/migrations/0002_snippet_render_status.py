@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='render_status',
+            field=models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('failed', 'failed')], default='done', max_length=10),
+        ),
+    ]
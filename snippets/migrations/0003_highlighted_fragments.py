@@ -0,0 +1,45 @@
+"""
+`highlighted`只保存高亮片段，不再包含完整的HTML文档和内联样式表
+
+渲染逻辑固定在迁移中，不依赖之后可能变化的`snippets.highlight`
+"""
+from django.db import migrations
+from pygments import highlight
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+BATCH_SIZE = 500
+
+
+def rerender(apps, full):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    batch = []
+    for snippet in Snippet.objects.filter(render_status='done').iterator(chunk_size=BATCH_SIZE):
+        linenos = snippet.linenos and 'table' or False
+        options = full and snippet.title and {'title': snippet.title} or {}
+        formatter = HtmlFormatter(style=snippet.style, linenos=linenos, full=full, **options)
+        snippet.highlighted = highlight(snippet.code, get_lexer_by_name(snippet.language), formatter)
+        batch.append(snippet)
+        if len(batch) >= BATCH_SIZE:
+            Snippet.objects.bulk_update(batch, ['highlighted'])
+            batch = []
+    Snippet.objects.bulk_update(batch, ['highlighted'])
+
+
+def to_fragments(apps, schema_editor):
+    rerender(apps, full=False)
+
+
+def to_documents(apps, schema_editor):
+    rerender(apps, full=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0002_snippet_render_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_fragments, to_documents),
+    ]
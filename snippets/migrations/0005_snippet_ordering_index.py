@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0004_snippet_updated'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='snippet',
+            options={'ordering': ['created', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+        ),
+    ]
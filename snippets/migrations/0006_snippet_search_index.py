@@ -0,0 +1,30 @@
+"""
+SQLite上的FTS5全文索引，见`snippets.search`；其他数据库不创建
+"""
+from django.db import migrations
+
+FTS_TABLE = 'snippets_snippet_fts'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, code, tokenize='unicode61')")
+    schema_editor.execute(f'INSERT INTO {FTS_TABLE} (rowid, title, code) SELECT id, title, code FROM snippets_snippet')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0005_snippet_ordering_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,98 @@
+"""
+高亮结果移到按内容寻址的`Blob`表中压缩保存，内容相同的代码段只保存一份
+
+压缩方式固定为zlib，不依赖之后可能变化的`snippets.compression`和配置，
+压缩数据的第一个字节`z`标明编码方式，与`snippets.compression`兼容。
+"""
+import hashlib
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def decode(payload):
+    payload = bytes(payload)
+    if payload[:1] == b'z':
+        return zlib.decompress(payload[1:]).decode('utf-8')
+    if payload[:1] == b'n':
+        return payload[1:].decode('utf-8')
+    raise ValueError(f'Unsupported blob codec {payload[:1]!r}')
+
+
+def to_blobs(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    Blob = apps.get_model('snippets', 'Blob')
+    batch = []
+
+    def flush():
+        blobs = {}
+        for snippet in batch:
+            key = digest(snippet.highlighted)
+            blobs.setdefault(key, Blob(digest=key, size=len(snippet.highlighted),
+                                       data=b'z' + zlib.compress(snippet.highlighted.encode('utf-8'))))
+            snippet.highlighted_blob_id = key
+        Blob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        Snippet.objects.bulk_update(batch, ['highlighted_blob'])
+        batch.clear()
+
+    for snippet in Snippet.objects.exclude(highlighted='').only('highlighted').iterator(chunk_size=BATCH_SIZE):
+        batch.append(snippet)
+        if len(batch) >= BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+
+def from_blobs(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    batch = []
+    queryset = Snippet.objects.filter(highlighted_blob__isnull=False).select_related('highlighted_blob')
+    for snippet in queryset.iterator(chunk_size=BATCH_SIZE):
+        snippet.highlighted = decode(snippet.highlighted_blob.data)
+        batch.append(snippet)
+        if len(batch) >= BATCH_SIZE:
+            Snippet.objects.bulk_update(batch, ['highlighted'])
+            batch = []
+    Snippet.objects.bulk_update(batch, ['highlighted'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0006_snippet_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='highlighted_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='snippets.blob'),
+        ),
+        # 回滚时先恢复可以为空的`highlighted`，再从`Blob`表填回
+        migrations.AlterField(
+            model_name='snippet',
+            name='highlighted',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(to_blobs, from_blobs),
+        migrations.RemoveField(
+            model_name='snippet',
+            name='highlighted',
+        ),
+    ]
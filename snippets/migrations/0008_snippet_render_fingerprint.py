@@ -0,0 +1,21 @@
+"""
+记录渲染输入的哈希，输入没有变化时保存不再重新渲染
+
+已有的数据行留空，下次保存时重新渲染，也可以用`rerender_snippets`命令批量刷新
+"""
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0007_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='render_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0008_snippet_render_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='snippet',
+            name='render_status',
+            field=models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('failed', 'failed'),
+                                            ('streamed', 'streamed')], default='done', max_length=10),
+        ),
+    ]
@@ -0,0 +1,29 @@
+"""
+列表接口的版本号，代替每次条件请求都要扫描整个表的`COUNT`/`MAX`
+"""
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    CollectionVersion = apps.get_model('snippets', 'CollectionVersion')
+    CollectionVersion.objects.using(schema_editor.connection.alias).bulk_create(
+        [CollectionVersion(name=name) for name in ('snippets', 'users')], ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0009_snippet_render_streamed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionVersion',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
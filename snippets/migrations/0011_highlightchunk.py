@@ -0,0 +1,39 @@
+"""
+超大代码段逐块保存的高亮结果，读取整页或某个行范围时不再重新做词法分析
+
+已有的`streamed`代码段由`rerender_snippets`命令改为逐块保存
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0010_collectionversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='snippet',
+            name='render_status',
+            field=models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('failed', 'failed'),
+                                            ('streamed', 'streamed'), ('chunked', 'chunked')],
+                                   default='done', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='HighlightChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+',
+                                           to='snippets.blob')),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                              related_name='highlight_chunks', to='snippets.snippet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('snippet', 'index'),
+                                                        name='highlight_chunk_snippet_index')],
+            },
+        ),
+    ]
@@ -1,19 +1,85 @@
-from django.db import models
-from pygments.lexers import get_all_lexers
-from pygments.styles import get_all_styles
+from django.db import models, router, transaction
+from django.db.models import F
+
+from . import compression
+from .choices import LANGUAGE_CHOICES, STYLE_CHOICES
+from .conf import snippets_setting
 # 保存模型时，使用`pygments`代码高亮显示库填充要高亮显示的字段
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters.html import HtmlFormatter
-from pygments import highlight
+from .highlight import (STREAM_CHUNK_LINES, cached_lookup, cached_render, count_lines, is_oversized, record_render,
+                        render_key, stream_chunks, timed_render_chunks)
+from .tasks import schedule_highlight
+
+
+class BlobManager(models.Manager):
+
+    def store(self, text):
+        """保存`text`并返回对应的`Blob`，内容相同的文本只保存一份"""
+        return self.store_many([text])[0]
+
+    def store_many(self, texts):
+        """批量保存，返回与`texts`一一对应的`Blob`列表，已经存在的内容不会重新压缩"""
+        digests = [compression.digest(text) for text in texts]
+        existing = set(self.filter(digest__in=set(digests)).values_list('digest', flat=True))
+        blobs = {}
+        for digest, text in zip(digests, texts):
+            if digest not in existing and digest not in blobs:
+                blobs[digest] = Blob(digest=digest, size=len(text), data=compression.encode(text))
+        # 并发保存相同的内容时由主键去重
+        self.bulk_create(blobs.values(), ignore_conflicts=True)
+        return [Blob(digest=digest, size=len(text))._with_text(text) for digest, text in zip(digests, texts)]
+
+    def prune(self):
+        """删除已经没有代码段引用的内容，返回删除的数量"""
+        return self.exclude(digest__in=Snippet.objects.filter(
+            highlighted_blob__isnull=False).values('highlighted_blob')).exclude(
+            digest__in=HighlightChunk.objects.values('blob')).delete()[0]
+
+
+class Blob(models.Model):
+    """按内容寻址、压缩保存的文本，见`snippets.compression`"""
+    # 压缩前内容的sha256
+    digest = models.CharField(primary_key=True, max_length=64)
+    # 压缩前的字符数
+    size = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return self.digest
 
+    def _with_text(self, text):
+        self._text = text
+        return self
 
-LEXERS = [item for item in get_all_lexers() if item[1]]
-LANGUAGE_CHOICES = sorted([(item[1][0], item[0]) for item in LEXERS])
-STYLE_CHOICES = sorted([(item, item) for item in get_all_styles()])
+    @property
+    def text(self):
+        """解压后的内容，只在第一次访问时解压"""
+        if not hasattr(self, '_text'):
+            self._text = compression.decode(self.data)
+        return self._text
 
 
 class Snippet(models.Model):
+    # 高亮渲染状态，开启后台渲染（`SNIPPETS['ASYNC_HIGHLIGHT']`）时才会出现`pending`和`failed`，
+    # 超过`SNIPPETS['HIGHLIGHT_MAX_BYTES']`的代码逐块保存渲染结果（见`HighlightChunk`），状态为`chunked`；
+    # `streamed`是之前不保存渲染结果、每次读取时重新渲染的超大代码段，由`rerender_snippets`命令改为逐块保存
+    RENDER_PENDING = 'pending'
+    RENDER_DONE = 'done'
+    RENDER_FAILED = 'failed'
+    RENDER_STREAMED = 'streamed'
+    RENDER_CHUNKED = 'chunked'
+    RENDER_STATUS_CHOICES = [
+        (RENDER_PENDING, 'pending'),
+        (RENDER_DONE, 'done'),
+        (RENDER_FAILED, 'failed'),
+        (RENDER_STREAMED, 'streamed'),
+        (RENDER_CHUNKED, 'chunked'),
+    ]
+
     created = models.DateTimeField(auto_now_add=True)
+    # 用于ETag/Last-Modified条件请求，见`snippets.conditional`
+    updated = models.DateTimeField(auto_now=True, db_index=True)
     title = models.CharField(max_length=100, blank=True, default='')
     code = models.TextField()
     linenos = models.BooleanField(default=False)
@@ -22,23 +88,171 @@ class Snippet(models.Model):
     # 你可以在ForeignKey 定义时设置related_name 参数来覆盖FOO_set 的名称。
     # 关联其他应用的模型 'app_name.model_name'
     owner = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='snippets')
-    highlighted = models.TextField()
+    # 高亮结果按内容去重压缩保存，通过`highlighted`属性读写
+    highlighted_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    render_status = models.CharField(choices=RENDER_STATUS_CHOICES, default=RENDER_DONE, max_length=10)
+    # 最近一次渲染（或正在进行的后台渲染）的输入哈希，即`render_key(*render_inputs())`，
+    # 包含Pygments和渲染器的版本，不同时才需要重新渲染，见`rerender_snippets`命令
+    render_fingerprint = models.CharField(max_length=64, blank=True, default='')
 
-    class Mate:
-        ordering = ['created']
+    class Meta:
+        ordering = ['created', 'id']
+        # 游标分页按(created, id)定位，见`snippets.pagination`
+        indexes = [
+            models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"title:{self.title}, language:{self.language}"
 
+    @property
+    def highlighted(self):
+        """高亮显示的HTML片段，访问时才查询并解压`highlighted_blob`，列表视图不需要时不会读取"""
+        if getattr(self, '_highlighted_dirty', False):
+            return self._highlighted
+        return self.highlighted_blob.text if self.highlighted_blob_id else ''
+
+    @highlighted.setter
+    def highlighted(self, value):
+        self._highlighted = value
+        self._highlighted_dirty = True
+
+    def store_highlighted(self):
+        """把修改过的`highlighted`写入`Blob`表并更新`highlighted_blob`"""
+        if getattr(self, '_highlighted_dirty', False):
+            self.highlighted_blob = Blob.objects.store(self._highlighted) if self._highlighted else None
+            self._highlighted_dirty = False
+
+    def chunks_for(self, start, end):
+        """包含第`start`到`end`行的`HighlightChunk`，连同压缩的内容一起查询"""
+        return self.highlight_chunks.filter(
+            index__range=((start - 1) // STREAM_CHUNK_LINES, (end - 1) // STREAM_CHUNK_LINES),
+        ).select_related('blob').order_by('index')
+
+    def line_range(self, lines=None):
+        """把`lines`（`(start, end)`，`end`为None表示到最后一行）限制在代码的行数之内"""
+        start, end = lines or (1, None)
+        total = count_lines(self.code)
+        return start, min(end or total, total)
+
+    def stream_chunks(self, chunks, start, end):
+        """从`chunks_for(start, end)`查询出的块逐块产生高亮片段，见`snippets.highlight.stream_chunks`"""
+        first = chunks[0].index * STREAM_CHUNK_LINES + 1 if chunks else start
+        return stream_chunks((chunk.blob.text for chunk in chunks), first, self.linenos, start, end)
+
+    def render_inputs(self):
+        """决定高亮结果的字段，标题只在响应时才加入页面，不影响渲染结果"""
+        return self.code, self.language, self.style, self.linenos
+
     def save(self, *args, **kwargs):
-        """使用`pygments`库创建一个高亮显示的HTML表示代码段。"""
-        lexer = get_lexer_by_name(self.language)
-        """
-        linenos = (True and 'table') or False => or 前的语句为True,所以不执行 or 后的语句 => linenos = 'table' 
-        linenos = (False and 'table') or False => or 前的语句为False,所以执行 or 后的语句 => linenos = False
-        """
-        linenos = self.linenos and 'table' or False
-        options = self.title and {'title': self.title} or {}
-        formatter = HtmlFormatter(style=self.style, linenos=linenos, full=True, **options)
-        self.highlighted = highlight(self.code, lexer, formatter)
-        super().save(*args, **kwargs)
+        """使用`pygments`库创建一个高亮显示的HTML片段表示代码段。"""
+        inputs = self.render_inputs()
+        fingerprint = render_key(*inputs)
+        if fingerprint == self.render_fingerprint and self.render_status in (self.RENDER_DONE, self.RENDER_CHUNKED):
+            # 只修改了标题等不影响渲染结果的字段。`pending`的实例可能在后台渲染完成之前读取，
+            # 原样保存会覆盖渲染结果，渲染任务也可能随进程重启丢失，和`failed`一样重新渲染（通常命中缓存）
+            self.store_highlighted()
+            super().save(*args, **kwargs)
+            return
+
+        # 之前逐块保存的结果不再有效
+        chunks = [] if self.render_status == self.RENDER_CHUNKED else None
+        self.render_fingerprint = fingerprint
+        self.highlighted = ''
+        if is_oversized(self.code) and not snippets_setting('ASYNC_HIGHLIGHT'):
+            # 很大的代码每`STREAM_CHUNK_LINES`行渲染成一块分别保存，读取时不需要再做词法分析，
+            # 它们不放入高亮缓存；开启后台渲染时和其他代码段一样在进程池中渲染
+            chunks, seconds = timed_render_chunks(*inputs)
+            record_render(self.language, self.style, chunks, seconds)
+            self.render_status = self.RENDER_CHUNKED
+        else:
+            # 内容相同的代码段直接复用缓存中的渲染结果，见`snippets.highlight`
+            if is_oversized(self.code):
+                highlighted = None
+            elif snippets_setting('ASYNC_HIGHLIGHT'):
+                highlighted = cached_lookup(*inputs)
+            else:
+                highlighted = cached_render(*inputs)
+            if highlighted is not None:
+                self.highlighted = highlighted
+                self.render_status = self.RENDER_DONE
+            else:
+                # 后台渲染：先保存数据行，事务提交后再交给进程池渲染
+                self.render_status = self.RENDER_PENDING
+        self.store_highlighted()
+
+        if chunks is None:
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic(using=router.db_for_write(type(self), instance=self)):
+                super().save(*args, **kwargs)
+                HighlightChunk.objects.replace({self.pk: chunks})
+        if self.render_status == self.RENDER_PENDING:
+            transaction.on_commit(lambda: schedule_highlight(self))
+
+
+class HighlightChunkManager(models.Manager):
+
+    def replace(self, chunks):
+        """`chunks`是`{代码段主键: render_chunks()的结果}`，替换这些代码段原有的块，空列表表示只删除"""
+        if not chunks:
+            return
+        self.filter(snippet__in=list(chunks)).delete()
+        blobs = iter(Blob.objects.store_many([chunk for texts in chunks.values() for chunk in texts]))
+        self.bulk_create([HighlightChunk(snippet_id=pk, index=index, blob=next(blobs))
+                          for pk, texts in chunks.items() for index in range(len(texts))])
+
+
+    def fragment(self, snippet_id, linenos):
+        """拼接代码段保存的全部块，得到与读取整页时相同的高亮片段"""
+        texts = [compression.decode(data) for data in self.filter(snippet_id=snippet_id).order_by(
+            'index').values_list('blob__data', flat=True)]
+        # 每一行都以换行结束
+        return ''.join(stream_chunks(texts, 1, linenos, 1, sum(text.count('\n') for text in texts)))
+
+
+class HighlightChunk(models.Model):
+    """超大代码段逐块保存的高亮结果，第`index`块是第`index * STREAM_CHUNK_LINES + 1`行开始的`STREAM_CHUNK_LINES`行
+
+    内容是`snippets.highlight.render_chunks()`的输出，不包括行号，读取整页或某个行范围时只需要取出和拼接。"""
+    snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE, related_name='highlight_chunks')
+    index = models.PositiveIntegerField()
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='+')
+
+    objects = HighlightChunkManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snippet', 'index'], name='highlight_chunk_snippet_index'),
+        ]
+
+    def __str__(self):
+        return f'{self.snippet_id}:{self.index}'
+
+
+class CollectionVersionManager(models.Manager):
+
+    def bump(self, *names):
+        """递增集合`names`的版本号，在写操作所在的事务中执行"""
+        for name in set(names):
+            if not self.filter(name=name).update(version=F('version') + 1):
+                self.bulk_create([self.model(name=name, version=1)], ignore_conflicts=True)
+
+    def version(self, name):
+        return self.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+class CollectionVersion(models.Model):
+    """列表接口的版本号，列表的条件请求只需要按主键读取一行，见`snippets.conditional`
+
+    - `snippets`：任何代码段变化或用户改名时递增
+    - `users`：用户或代码段的新增、删除以及用户改名时递增
+
+    由`snippets.response_cache.bump()`递增，绕过信号的批量写入也调用它。"""
+    name = models.CharField(primary_key=True, max_length=32)
+    version = models.BigIntegerField(default=0)
+
+    objects = CollectionVersionManager()
+
+    def __str__(self):
+        return f'{self.name}:{self.version}'
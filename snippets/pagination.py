@@ -0,0 +1,101 @@
+"""
+基于游标（keyset）的分页
+
+`PageNumberPagination`的每一页都需要`COUNT(*)`和越来越大的`OFFSET`，翻到很深的页时会越来越慢。
+游标分页按稳定的排序字段定位下一页：`WHERE created > <上一页最后一行> ORDER BY created, id LIMIT n`，
+配合(created, id)复合索引，无论翻到第几页耗时都基本不变。
+"""
+from collections import OrderedDict
+
+from rest_framework.pagination import BasePagination, CursorPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CountableCursorPagination(CursorPagination):
+    """客户端可以通过`page_size`选择每页数量（不超过`max_page_size`）。
+
+    默认不返回总数，因为`COUNT(*)`会扫描整个表；需要时传入`count=true`。"""
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        items = [('next', self.get_next_link()), ('previous', self.get_previous_link())]
+        if self.count is not None:
+            items.insert(0, ('count', self.count))
+        return Response(OrderedDict(items + [('results', data)]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return response_schema
+
+
+class SnippetCursorPagination(CountableCursorPagination):
+    # 必须与`Snippet.Meta.indexes`中的复合索引一致
+    ordering = ('created', 'id')
+
+
+class UserCursorPagination(CountableCursorPagination):
+    ordering = ('id',)
+
+
+class SearchPagination(BasePagination):
+    """搜索结果按相关度排序，没有可以作为游标的稳定字段，所以使用offset分页。
+
+    多取一行来判断是否有下一页，不计算总数。"""
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    offset_query_param = 'offset'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.offset = self.get_offset(request)
+        results = list(queryset[self.offset:self.offset + self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        return results[:self.page_size]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_offset(self, request):
+        try:
+            return _positive_int(request.query_params[self.offset_query_param])
+        except (KeyError, ValueError):
+            return 0
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, self.offset + self.page_size)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        offset = max(self.offset - self.page_size, 0)
+        if offset == 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.offset_query_param, offset)
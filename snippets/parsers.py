@@ -0,0 +1,29 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """解析换行分隔的JSON（每行一个JSON对象）
+
+    返回一个生成器，按行读取请求体，不会一次性把整个请求解析到内存中。空行会被忽略。
+    无法解析的行产生一个`ParseError`实例而不是抛出异常，之前的批次可能已经写入，由使用者按条目记录错误。"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self.iter_items(stream, encoding)
+
+    @staticmethod
+    def iter_items(stream, encoding):
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.decode(encoding))
+            except ValueError as exc:
+                yield ParseError(f'NDJSON parse error on line {number} - {exc}')
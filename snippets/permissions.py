@@ -11,4 +11,5 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # 只有该snippet的所有者才允许写权限
-        return obj.owner == request.user
+        # 比较外键的值，不需要为了这次比较去查询关联的`User`
+        return obj.owner_id == request.user.id
@@ -0,0 +1,52 @@
+"""
+更快的JSON渲染器
+
+`FastJSONRenderer`在安装了orjson时用它编码，没有浮点数的数据输出与DRF的`JSONRenderer`逐字节相同。
+orjson不能处理的数据（例如超出64位的整数）以及需要缩进的请求交给`JSONRenderer`处理，
+日期、Decimal等类型仍然由DRF的`JSONEncoder`转换，所以格式不会改变。
+
+浮点数的值相同，但写法可能不同（orjson输出`1e16`和`0.000025`，标准库输出`1e+16`和`2.5e-05`）。
+现在的序列化器都没有浮点数字段；需要逐字节相同的视图不应使用这个渲染器。
+"""
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import renderers
+
+from .conf import snippets_setting
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_backend():
+    """根据`SNIPPETS['JSON_BACKEND']`返回使用的编码库，None表示标准库`json`"""
+    backend = snippets_setting('JSON_BACKEND')
+    if backend is None:
+        return orjson
+    if backend == 'orjson':
+        if orjson is None:
+            raise ImproperlyConfigured("SNIPPETS['JSON_BACKEND'] = 'orjson' requires the orjson package "
+                                       "(pipenv install --categories speedups).")
+        return orjson
+    if backend == 'json':
+        return None
+    raise ImproperlyConfigured(f"Unknown SNIPPETS['JSON_BACKEND']: {backend!r}")
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        backend = get_backend()
+        # orjson只能输出紧凑、不转义非ASCII字符、不允许NaN的格式，与DRF的默认设置相同
+        if (data is None or backend is None or self.ensure_ascii or not self.compact or not self.strict
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = backend.dumps(data, default=self.encoder_class().default,
+                                option=backend.OPT_NON_STR_KEYS | backend.OPT_PASSTHROUGH_DATETIME
+                                | backend.OPT_PASSTHROUGH_DATACLASS)
+        except backend.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # 与`JSONRenderer`一样转义U+2028和U+2029
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
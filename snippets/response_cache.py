@@ -0,0 +1,288 @@
+"""
+匿名读请求的服务端响应缓存
+
+缓存`SnippetViewSet`的`list`、`retrieve`、`highlight`和`UserViewSet`的`list`、`retrieve`渲染后的响应，
+命中时不再计算验证器、查询数据库、序列化或渲染高亮页面，只有匿名的GET/HEAD请求使用缓存。
+
+缓存键包括完整的URL（协议、主机、路径和格式后缀、排序后的查询参数）、协商出的媒体类型，
+以及响应依赖的数据的版本号。可浏览API（`BrowsableAPIRenderer`）的页面带有每个访客自己的CSRF令牌，
+设置Cookie的响应也不能共享，都不缓存。数据变化时由`snippets.signals`中的信号（或绕过信号的批量写入）递增版本号，
+旧的条目不再被读取，随过期时间淘汰：
+- `snippets`：代码段列表，任何代码段变化或用户改名时递增
+- `snippet:<pk>`：代码段详情和高亮页面，代码段本身变化或所有者改名时递增
+- `users`：用户列表，用户或代码段的新增、删除以及用户改名时递增
+- `user:<pk>`：用户详情，用户改名或他的代码段新增、删除时递增
+
+防止缓存击穿：条目在`RESPONSE_CACHE_TIMEOUT`之后软过期，之后的`RESPONSE_CACHE_STALE_SECONDS`内
+只有拿到锁（`cache.add`）的一个请求重新生成，其他请求继续使用旧的响应；
+完全没有条目时其他请求最多等待`RESPONSE_CACHE_LOCK_SECONDS`，等第一个请求生成后直接使用。
+
+异步视图（见`snippets.async_views`）使用`acached()`，通过缓存的异步接口读取，等待时不占用线程。
+"""
+import asyncio
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+from rest_framework.renderers import BrowsableAPIRenderer
+
+from . import metrics
+from .conf import snippets_setting
+from .db_routers import use_primary
+
+# 命中时恢复的响应头，`Allow`和`Vary`由视图在`finalize_response`中重新加上
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+POLL_SECONDS = 0.05
+
+
+# 在数据库中保存版本号的集合，见`snippets.models.CollectionVersion`
+COLLECTIONS = frozenset(['snippets', 'users'])
+
+
+def get_cache():
+    """返回响应缓存使用的Django缓存，没有配置`SNIPPETS['RESPONSE_CACHE_ALIAS']`时返回None"""
+    alias = snippets_setting('RESPONSE_CACHE_ALIAS')
+    return alias and caches[alias] or None
+
+
+def version_key(name):
+    return f'snippets:response:version:{name}'
+
+
+def get_versions(cache, names):
+    keys = [version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # 版本号被淘汰后用当前时间重新开始，不会与之前的版本号重复
+        for key in missing:
+            cache.add(key, time.time_ns())
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+async def aget_versions(cache, names):
+    keys = [version_key(name) for name in names]
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, time.time_ns())
+        versions.update(await cache.aget_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump(*names):
+    """递增`names`的版本号
+
+    集合（`COLLECTIONS`）的版本号同时保存在数据库中，供列表的条件请求使用，在写操作所在的事务中递增；
+    缓存中的版本号在事务提交后递增，避免并发的请求用提交前的数据生成新版本的条目"""
+    collections = COLLECTIONS.intersection(names)
+    if collections:
+        # `models`导入了`tasks`，`tasks`又导入了这个模块
+        from .models import CollectionVersion
+        CollectionVersion.objects.bump(*collections)
+
+    cache = get_cache()
+    if cache is None or not names:
+        return
+
+    def increment():
+        for name in set(names):
+            try:
+                cache.incr(version_key(name))
+            except ValueError:
+                cache.set(version_key(name), time.time_ns(), None)
+
+    transaction.on_commit(increment)
+
+
+def snippets_changed(pks, owners=()):
+    """代码段`pks`的内容变化或被删除，`owners`是代码段链接发生变化（新增或删除代码段）或改名的用户
+
+    `pks`可以是查询集，没有配置响应缓存时不会执行查询。"""
+    names = ['snippets'] + (['users'] if owners else [])
+    if get_cache() is not None:
+        names += [f'snippet:{pk}' for pk in pks] + [f'user:{pk}' for pk in owners]
+    bump(*names)
+
+
+def request_key(request, versions):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    parts = (request.scheme, request.get_host(), request.path, query, request.accepted_media_type, versions)
+    return 'snippets:response:%s' % hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def acquire(cache, key):
+    return cache.add(f'{key}:lock', 1, snippets_setting('RESPONSE_CACHE_LOCK_SECONDS'))
+
+
+def release(cache, key):
+    cache.delete(f'{key}:lock')
+
+
+async def aacquire(cache, key):
+    return await cache.aadd(f'{key}:lock', 1, snippets_setting('RESPONSE_CACHE_LOCK_SECONDS'))
+
+
+async def arelease(cache, key):
+    await cache.adelete(f'{key}:lock')
+
+
+def restore(request, entry):
+    _, content, headers = entry
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified and parse_http_date_safe(last_modified),
+    )
+    if response is None:
+        response = HttpResponse(content)
+        response['Content-Type'] = headers['Content-Type']
+    for name in ('ETag', 'Last-Modified'):
+        if name in headers:
+            response[name] = headers[name]
+    return response
+
+
+class ResponseCacheMixin:
+    """为视图集的读操作加上响应缓存
+
+    子类实现`get_cache_versions()`，根据`self.action`和`self.kwargs`返回响应所依赖的版本名称列表，
+    返回None时不使用缓存。"""
+
+    def get_cache_versions(self):
+        raise NotImplementedError
+
+    def cache_for(self, request):
+        """返回这个请求使用的缓存和版本名称，不使用缓存时返回`(None, None)`"""
+        cache = get_cache()
+        if cache is None or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return None, None
+        if isinstance(request.accepted_renderer, BrowsableAPIRenderer):
+            return None, None
+        names = self.get_cache_versions()
+        if names is None:
+            return None, None
+        return cache, names
+
+    def cached(self, handler, request, *args, **kwargs):
+        cache, names = self.cache_for(request)
+        if cache is None:
+            return handler(request, *args, **kwargs)
+
+        key = request_key(request, get_versions(cache, names))
+        entry = cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            metrics.RESPONSE_CACHE.inc(result='hit')
+            return restore(request, entry)
+        if not acquire(cache, key):
+            if entry is not None:
+                # 其他请求正在重新生成，先使用软过期的响应
+                metrics.RESPONSE_CACHE.inc(result='stale')
+                return restore(request, entry)
+            entry = self.wait(cache, key)
+            if entry is not None:
+                metrics.RESPONSE_CACHE.inc(result='wait')
+                return restore(request, entry)
+        metrics.RESPONSE_CACHE.inc(result='miss')
+
+        try:
+            # 条目会被使用到下一次版本变化，从主库生成，不使用可能落后的只读副本
+            with use_primary():
+                response = handler(request, *args, **kwargs)
+        except BaseException:
+            release(cache, key)
+            raise
+        if not self.cacheable(response):
+            release(cache, key)
+            return response
+        return self.store_on_render(cache, key, response)
+
+    async def acached(self, handler, request, *args, **kwargs):
+        """`cached()`的异步版本，`handler`是协程函数"""
+        cache, names = self.cache_for(request)
+        if cache is None:
+            return await handler(request, *args, **kwargs)
+
+        key = request_key(request, await aget_versions(cache, names))
+        entry = await cache.aget(key)
+        if entry is not None and entry[0] > time.time():
+            metrics.RESPONSE_CACHE.inc(result='hit')
+            return restore(request, entry)
+        if not await aacquire(cache, key):
+            if entry is not None:
+                metrics.RESPONSE_CACHE.inc(result='stale')
+                return restore(request, entry)
+            entry = await self.await_entry(cache, key)
+            if entry is not None:
+                metrics.RESPONSE_CACHE.inc(result='wait')
+                return restore(request, entry)
+        metrics.RESPONSE_CACHE.inc(result='miss')
+
+        try:
+            with use_primary():
+                response = await handler(request, *args, **kwargs)
+        except BaseException:
+            await arelease(cache, key)
+            raise
+        if not self.cacheable(response):
+            await arelease(cache, key)
+            return response
+        return self.store_on_render(cache, key, response)
+
+    @staticmethod
+    def cacheable(response):
+        return response.status_code == 200 and hasattr(response, 'add_post_render_callback')
+
+    @staticmethod
+    def store_on_render(cache, key, response):
+        # 渲染在同步代码中进行（ASGI下也在线程中），所以这里使用同步的缓存接口
+        def store(response):
+            # 渲染时生成了CSRF令牌或者设置了Cookie，响应只属于当前访客
+            if response.cookies or response.renderer_context['request'].META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+                release(cache, key)
+                return
+            timeout = snippets_setting('RESPONSE_CACHE_TIMEOUT')
+            headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+            cache.set(key, (time.time() + timeout, response.content, headers),
+                      timeout + snippets_setting('RESPONSE_CACHE_STALE_SECONDS'))
+            release(cache, key)
+
+        response.add_post_render_callback(store)
+        return response
+
+    @staticmethod
+    def wait(cache, key):
+        deadline = time.monotonic() + snippets_setting('RESPONSE_CACHE_LOCK_SECONDS')
+        while time.monotonic() < deadline:
+            time.sleep(POLL_SECONDS)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+            if acquire(cache, key):
+                # 生成响应的请求失败了，由当前请求接手
+                return None
+        return None
+
+    @staticmethod
+    async def await_entry(cache, key):
+        deadline = time.monotonic() + snippets_setting('RESPONSE_CACHE_LOCK_SECONDS')
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_SECONDS)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry
+            if await aacquire(cache, key):
+                return None
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,83 @@
+"""
+代码段标题和代码的全文搜索
+
+在SQLite上使用FTS5虚拟表`snippets_snippet_fts`（rowid与代码段的id相同），
+保存和删除代码段时通过信号同步索引（见`snippets.signals`），批量导入时由`snippets.bulk`同步。
+其他数据库没有这张表，退化为`icontains`过滤。
+
+索引损坏或与数据不一致时执行`python manage.py rebuild_search_index`重建。
+"""
+from django.db import connections
+from django.db.models import Q
+
+FTS_TABLE = 'snippets_snippet_fts'
+
+
+def is_supported(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, code, tokenize='unicode61')")
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def index_snippets(snippets, using='default'):
+    """把代码段写入（或替换）索引"""
+    if not is_supported(using) or not snippets:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(snippet.pk,) for snippet in snippets])
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, code) VALUES (%s, %s, %s)',
+                           [(snippet.pk, snippet.title, snippet.code) for snippet in snippets])
+
+
+def remove_snippets(pks, using='default'):
+    if not is_supported(using) or not pks:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+
+def rebuild_index(using='default'):
+    """清空索引并从`snippets_snippet`重新写入全部代码段，返回写入的行数"""
+    connection = connections[using]
+    drop_index(connection)
+    create_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, title, code) SELECT id, title, code FROM snippets_snippet')
+        return cursor.rowcount
+
+
+def match_expression(query):
+    """把用户输入转换为安全的FTS5查询：每个词都作为短语加上引号，词之间是AND关系，
+    以`*`结尾的词做前缀匹配"""
+    terms = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if term:
+            terms.append('"%s"%s' % (term.replace('"', '""'), prefix and '*' or ''))
+    return ' '.join(terms)
+
+
+def search(queryset, query):
+    """返回按相关度排序的搜索结果，相关度保存在`search_rank`上（越小越相关）"""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not is_supported(queryset.db):
+        return queryset.filter(Q(title__icontains=query) | Q(code__icontains=query)).order_by('-created', '-id')
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        select={'search_rank': f'{FTS_TABLE}.rank'},
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[expression],
+        order_by=['search_rank', 'id'],
+    )
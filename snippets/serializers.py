@@ -4,6 +4,7 @@ a ModelSerializer class which provides a useful shortcut for creating serializer
 """
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from . import metrics
 from .models import Snippet, LANGUAGE_CHOICES, STYLE_CHOICES
 
 
@@ -64,7 +65,25 @@ OrderedDict([('title', ''), ('code', 'print "hello, world"'), ('linenos', False)
 """
 
 
-class SnippetModelSerializer(serializers.HyperlinkedModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    """记录`many=True`序列化的耗时"""
+
+    @property
+    def data(self):
+        with metrics.SERIALIZER_SECONDS.time(serializer=type(self.child).__name__, many=True):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """记录单个对象序列化的耗时，`many=True`时使用`TimedListSerializer`"""
+
+    @property
+    def data(self):
+        with metrics.SERIALIZER_SECONDS.time(serializer=type(self).__name__, many=False):
+            return super().data
+
+
+class SnippetModelSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     """ModelSerializer类并不会做任何特别神奇的事情， 他们只是创建序列化器类的快捷方式：
     1. 一组自动确定的字段
     2. 默认简单实现的create()和update()方法
@@ -93,10 +112,12 @@ class SnippetModelSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Snippet
         fields = ('url', 'id', 'highlight', 'title', 'owner',
-                  'title', 'code', 'linenos', 'language', 'style')
+                  'title', 'code', 'linenos', 'language', 'style', 'render_status')
+        read_only_fields = ('render_status',)
+        list_serializer_class = TimedListSerializer
 
 
-class UserModelSerializer(serializers.HyperlinkedModelSerializer):
+class UserModelSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     snippets = serializers.HyperlinkedRelatedField(many=True, view_name='snippet-detail', read_only=True)
     # !! 由于`snippets`在用户模型中是一个反向关联的关系。在使用`ModelSerializer`类时它默认不会被包含，
     # 所以我们需要为它添加一个显式字段
@@ -105,6 +126,7 @@ class UserModelSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ('url', 'id', 'username', 'snippets')  # ForeignKey.related_name=snippets
+        list_serializer_class = TimedListSerializer
 
 
 if __name__ == "__main__":
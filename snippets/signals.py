@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import response_cache, search
+from .models import Snippet
+
+
+@receiver(post_save, sender=Snippet)
+def index_snippet(sender, instance, using, **kwargs):
+    search.index_snippets([instance], using=using)
+
+
+@receiver(post_delete, sender=Snippet)
+def unindex_snippet(sender, instance, using, **kwargs):
+    search.remove_snippets([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Snippet)
+def snippet_saved(sender, instance, created, **kwargs):
+    response_cache.snippets_changed([instance.pk], owners=created and [instance.owner_id] or ())
+
+
+@receiver(post_delete, sender=Snippet)
+def snippet_deleted(sender, instance, **kwargs):
+    response_cache.snippets_changed([instance.pk], owners=[instance.owner_id])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        response_cache.bump('users')
+    elif update_fields is None or 'username' in update_fields:
+        # 只有用户名会出现在响应中，登录时只更新`last_login`，不需要失效
+        snippets = Snippet.objects.filter(owner=instance)
+        # 代码段的表示包含用户名，`Last-Modified`也要变化，见`snippets.conditional`
+        snippets.update(updated=timezone.now())
+        response_cache.snippets_changed(snippets.values_list('pk', flat=True), owners=[instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # 用户的代码段被级联删除，各自发送`post_delete`
+    response_cache.bump('users', f'user:{instance.pk}')
@@ -0,0 +1,87 @@
+"""
+后台高亮渲染
+
+开启`SNIPPETS['ASYNC_HIGHLIGHT']`后，`Snippet.save()`只保存数据行并把状态设为`pending`，
+高亮渲染交给本地的进程池完成，渲染结束后再回写`highlighted`和`render_status`；
+超大的代码逐块渲染，回写到`HighlightChunk`表。
+进程池在第一次使用时创建，每个Web worker进程各有一个。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import highlight, response_cache
+from .conf import snippets_setting
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """返回进程级的渲染进程池，worker数量由`SNIPPETS['HIGHLIGHT_WORKERS']`决定，默认等于CPU核数"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = snippets_setting('HIGHLIGHT_WORKERS') or os.cpu_count() or 1
+                _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def schedule_highlight(snippet):
+    """把`snippet`的高亮渲染提交到进程池，返回对应的`Future`"""
+    inputs = snippet.render_inputs()
+    render = highlight.timed_render_chunks if highlight.is_oversized(snippet.code) else highlight.timed_render
+    future = get_executor().submit(render, *inputs)
+    future.add_done_callback(partial(store_highlight, snippet.pk, inputs))
+    return future
+
+
+def store_highlight(pk, inputs, future):
+    """渲染完成后的回调，在进程池的管理线程中执行"""
+    from .models import Blob, HighlightChunk, Snippet
+
+    _, language, style, _ = inputs
+    chunks = None
+    try:
+        highlighted, seconds = future.result()
+    except Exception:
+        logger.exception('Highlighting snippet %s failed', pk)
+        highlighted, status = '', Snippet.RENDER_FAILED
+    else:
+        highlight.record_render(language, style, highlighted, seconds)
+        if isinstance(highlighted, list):
+            # `timed_render_chunks()`的结果，不放入高亮缓存
+            chunks, highlighted, status = highlighted, '', Snippet.RENDER_CHUNKED
+        else:
+            highlight.get_cache().set(highlight.render_key(*inputs), highlighted)
+            status = Snippet.RENDER_DONE
+    try:
+        blob = Blob.objects.store(highlighted) if highlighted else None
+        with transaction.atomic():
+            # 只有渲染输入没有再被修改时才回写，避免较旧的结果覆盖较新的保存
+            updated = Snippet.objects.filter(pk=pk, render_fingerprint=highlight.render_key(*inputs)).update(
+                highlighted_blob=blob, render_status=status, updated=timezone.now(),
+            )
+            if updated and chunks is not None:
+                HighlightChunk.objects.replace({pk: chunks})
+            # `update()`不发送`post_save`信号
+            response_cache.snippets_changed([pk])
+    finally:
+        # 回调线程不经过请求周期，需要自己关闭数据库连接
+        connection.close()
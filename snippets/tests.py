@@ -1,3 +1,985 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import benchmarks, choices, compression, db_routers, highlight, metrics
+from .models import Blob, Snippet
+from .renderers import FastJSONRenderer
+from .tasks import store_highlight
+
+
+class QueryBudgetMixin:
+    """检查接口的查询次数不随每页数量增长"""
+
+    def assertQueryBudget(self, url, page_sizes=(1, 10), max_queries=None, **extra):
+        counts = {}
+        for page_size in page_sizes:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, {'page_size': page_size}, **extra)
+            self.assertEqual(response.status_code, 200)
+            counts[page_size] = len(context.captured_queries)
+        self.assertEqual(len(set(counts.values())), 1,
+                         f'{url} query count grows with page size: {counts}')
+        if max_queries is not None:
+            self.assertLessEqual(max(counts.values()), max_queries,
+                                 f'{url} exceeds its budget of {max_queries} queries: {counts}')
+        return counts
+
+
+class HighlightCacheTests(TestCase):
+
+    def setUp(self):
+        highlight.reset_cache()
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def test_identical_snippets_render_once(self):
+        for _ in range(3):
+            Snippet.objects.create(owner=self.owner, code='print(123)\n')
+        stats = highlight.cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['local_hits'], 2)
+
+    def test_key_depends_on_every_input(self):
+        base = ('x = 1\n', 'python', 'friendly', False)
+        keys = {highlight.render_key(*base)}
+        for index, value in enumerate(('y = 2\n', 'ruby', 'monokai', True)):
+            changed = list(base)
+            changed[index] = value
+            keys.add(highlight.render_key(*changed))
+        self.assertEqual(len(keys), 5)
+
+    def test_local_tier_is_bounded(self):
+        cache = highlight.HighlightCache(max_bytes=500)
+        for index in range(10):
+            cache.set(str(index), 'x' * 100)
+        self.assertLessEqual(cache.stats()['bytes'], 500)
+        self.assertIsNone(cache.get('0'))
+        self.assertIsNotNone(cache.get('9'))
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_CACHE_ALIAS': 'default'})
+    def test_shared_tier(self):
+        Snippet.objects.create(owner=self.owner, code='print(456)\n')
+        highlight.get_cache().clear()
+        Snippet.objects.create(owner=self.owner, code='print(456)\n')
+        self.assertEqual(highlight.cache_stats()['shared_hits'], 1)
+
+
+class BlobStorageTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def test_identical_snippets_share_a_blob(self):
+        first = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+        second = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+        self.assertEqual(first.highlighted_blob_id, second.highlighted_blob_id)
+        self.assertEqual(Blob.objects.count(), 1)
+        blob = Blob.objects.get()
+        self.assertLess(len(blob.data), blob.size)
+
+    def test_highlighted_is_loaded_lazily(self):
+        created = Snippet.objects.create(owner=self.owner, code='print(2)\n')
+        snippet = Snippet.objects.get(pk=created.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(snippet.highlighted, created.highlighted)
+        with self.assertNumQueries(0):
+            snippet.highlighted
+
+    def test_codecs(self):
+        text = '<div class="highlight">中文</div>' * 10
+        for codec in (None, 'zlib'):
+            with override_settings(SNIPPETS={'BLOB_CODEC': codec}):
+                self.assertEqual(compression.decode(compression.encode(text)), text)
+
+    def test_prune(self):
+        snippet = Snippet.objects.create(owner=self.owner, code='print(3)\n')
+        snippet.code = 'print(4)\n'
+        snippet.save()
+        self.assertEqual(Blob.objects.prune(), 1)
+        self.assertEqual(Blob.objects.get().digest, snippet.highlighted_blob_id)
+
+
+class RenderFingerprintTests(TestCase):
+
+    def setUp(self):
+        highlight.reset_cache()
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def lookups(self):
+        stats = highlight.cache_stats()
+        return stats['local_hits'] + stats['shared_hits'] + stats['misses']
+
+    def test_unrelated_change_skips_rendering(self):
+        snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+        before = self.lookups()
+        snippet.title = 'renamed'
+        snippet.save()
+        self.assertEqual(self.lookups(), before)
+        snippet.code = 'print(2)\n'
+        snippet.save()
+        self.assertEqual(self.lookups(), before + 1)
+
+    def test_rerender_command(self):
+        snippets = [Snippet.objects.create(owner=self.owner, code=f'print({n})\n') for n in range(3)]
+        fresh = Snippet.objects.get(pk=snippets[0].pk).render_fingerprint
+        Snippet.objects.filter(pk__in=[snippet.pk for snippet in snippets[1:]]).update(
+            render_fingerprint='', highlighted_blob=None)
+        with tempfile.TemporaryDirectory() as directory:
+            state = os.path.join(directory, 'state.json')
+            out = io.StringIO()
+            call_command('rerender_snippets', '--batch-size=2', f'--state-file={state}', stdout=out)
+            self.assertIn('Re-rendered 2 stale snippets', out.getvalue())
+            with open(state) as f:
+                self.assertEqual(json.load(f)['last_pk'], snippets[-1].pk)
+            out = io.StringIO()
+            call_command('rerender_snippets', '--resume', f'--state-file={state}', stdout=out)
+            self.assertIn('Scanned 0 snippets', out.getvalue())
+        self.assertEqual(Snippet.objects.get(pk=snippets[0].pk).render_fingerprint, fresh)
+        for snippet in Snippet.objects.all():
+            self.assertEqual(snippet.render_fingerprint, highlight.render_key(*snippet.render_inputs()))
+            self.assertEqual(snippet.highlighted, highlight.render(*snippet.render_inputs()))
+
+
+class HighlightPageTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def test_stores_fragment_and_links_shared_stylesheet(self):
+        snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n', title='<demo>', style='monokai')
+        self.assertTrue(snippet.highlighted.startswith('<div class="highlight">'))
+        self.assertNotIn('<style', snippet.highlighted)
+
+        response = self.client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertContains(response, 'http://testserver/snippets/styles/monokai.css?v=')
+        self.assertContains(response, '&lt;demo&gt;')
+        self.assertContains(response, snippet.highlighted)
+
+    def test_stylesheet_is_cacheable(self):
+        response = self.client.get('/snippets/styles/monokai.css')
+        self.assertEqual(response['Content-Type'], 'text/css; charset=utf-8')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('.highlight', response.content.decode())
+
+        response = self.client.get('/snippets/styles/monokai.css', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/snippets/styles/missing.css').status_code, 404)
+
+
+class LineRangeTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        self.code = benchmarks.make_code('python', 1200)
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_stream_matches_stored_fragment(self):
+        for language in benchmarks.LANGUAGE_SAMPLES:
+            code = benchmarks.make_code(language, 1200)
+            self.assertEqual(''.join(highlight.stream_fragment(code, language, 'friendly', False)),
+                             highlight.render(code, language, 'friendly', False))
+
+    def test_line_range(self):
+        snippet = Snippet.objects.create(owner=self.owner, code='"""doc\nstring\n"""\nx = 1\n', linenos=True)
+        response = self.client.get(f'/snippets/{snippet.pk}/highlight/', {'lines': '2-3'})
+        self.assertEqual(response.status_code, 200)
+        # 行范围的页面不是流式响应，可以放入响应缓存
+        self.assertFalse(response.streaming)
+        content = response.content.decode()
+        self.assertIn('<span class="linenos">2</span><span class="sd">string</span>', content)
+        self.assertIn('<span class="linenos">3</span>', content)
+        self.assertNotIn('doc', content)
+        self.assertNotIn('<span class="linenos">4</span>', content)
+        for value in ('a-b', '0-2', '5-3'):
+            response = self.client.get(f'/snippets/{snippet.pk}/highlight/', {'lines': value})
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    def test_oversized_snippet_is_stored_in_chunks(self):
+        snippet = Snippet.objects.create(owner=self.owner, code=self.code, title='big')
+        self.assertEqual(snippet.render_status, Snippet.RENDER_CHUNKED)
+        self.assertIsNone(snippet.highlighted_blob_id)
+        self.assertEqual(snippet.highlight_chunks.count(), 3)
+        with mock.patch('snippets.highlight.get_line_lexer') as lexer:
+            response = self.client.get(f'/snippets/{snippet.pk}/highlight/')
+            self.assertTrue(response.streaming)
+            content = self.read(response)
+        lexer.assert_not_called()
+        self.assertIn(highlight.render(self.code, 'python', 'friendly', False), content)
+        self.assertIn('<title>big</title>', content)
+
+        snippet.title = 'bigger'
+        snippet.save()
+        self.assertEqual(snippet.render_status, Snippet.RENDER_CHUNKED)
+        self.assertEqual(snippet.highlight_chunks.count(), 3)
+        snippet.code = self.code[:len(self.code) // 2]
+        snippet.save()
+        self.assertEqual(snippet.highlight_chunks.count(), 2)
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    def test_chunked_line_range_matches_token_stream(self):
+        snippet = Snippet.objects.create(owner=self.owner, code=self.code, linenos=True)
+        for start, end in ((1, 3), (480, 1020), (500, 501), (1100, 5000), (2000, 2001)):
+            response = self.client.get(f'/snippets/{snippet.pk}/highlight/', {'lines': f'{start}-{end}'})
+            self.assertFalse(response.streaming)
+            expected = ''.join(highlight.stream_fragment(self.code, 'python', 'friendly', True, start, end))
+            self.assertIn(expected, response.content.decode(), (start, end))
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    def test_large_chunked_range_is_streamed(self):
+        snippet = Snippet.objects.create(owner=self.owner, code=self.code)
+        with mock.patch('snippets.views.MAX_BUFFERED_LINES', 100):
+            for value, start in (('1-', 1), ('600-', 600)):
+                response = self.client.get(f'/snippets/{snippet.pk}/highlight/', {'lines': value})
+                self.assertTrue(response.streaming)
+                expected = ''.join(highlight.stream_fragment(self.code, 'python', 'friendly', False, start))
+                self.assertIn(expected, self.read(response))
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    def test_streamed_snippets_are_rerendered_in_chunks(self):
+        snippet = Snippet.objects.create(owner=self.owner, code=self.code)
+        # 之前读取时才渲染的超大代码段
+        snippet.highlight_chunks.all().delete()
+        Snippet.objects.filter(pk=snippet.pk).update(render_status=Snippet.RENDER_STREAMED)
+        response = self.client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertIn(highlight.render(self.code, 'python', 'friendly', False), self.read(response))
+
+        call_command('rerender_snippets', stdout=io.StringIO())
+        snippet.refresh_from_db()
+        self.assertEqual(snippet.render_status, Snippet.RENDER_CHUNKED)
+        self.assertEqual(snippet.highlight_chunks.count(), 3)
+        self.assertEqual(Blob.objects.prune(), 0)
+
+
+class ConditionalRequestTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        self.snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+        self.url = f'/snippets/{self.snippet.pk}/'
+
+    def test_revalidation_costs_one_query(self):
+        for url in (self.url, f'{self.url}highlight/', '/snippets/', '/users/', f'/users/{self.owner.pk}/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate_validators(self):
+        snippet_etag = self.client.get(self.url)['ETag']
+        list_etag = self.client.get('/snippets/')['ETag']
+        users_etag = self.client.get('/users/')['ETag']
+        Snippet.objects.create(owner=self.owner, code='print(2)\n')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=snippet_etag).status_code, 304)
+        self.assertEqual(self.client.get('/snippets/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+        self.assertEqual(self.client.get('/users/', HTTP_IF_NONE_MATCH=users_etag).status_code, 200)
+
+    def test_rename_invalidates_validators(self):
+        urls = (self.url, f'{self.url}highlight/', '/snippets/', '/users/', f'/users/{self.owner.pk}/')
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.owner.username = 'alicia'
+        self.owner.save()
+        for url in urls:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 200, url)
+
+    def test_rename_changes_last_modified(self):
+        Snippet.objects.filter(pk=self.snippet.pk).update(updated=timezone.now() - timedelta(hours=1))
+        for url in (self.url, f'{self.url}highlight/'):
+            last_modified = self.client.get(url)['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.owner.username = 'alicia'
+        self.owner.save()
+        for url in (self.url, f'{self.url}highlight/'):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(self.client.get(self.url, HTTP_ACCEPT='application/json'), 'alicia')
+
+    def test_if_match_on_write(self):
+        self.client.login(username='alice', password='secret')
+        etag = self.client.get(self.url, HTTP_ACCEPT='application/json')['ETag']
+        data = '{"code": "print(3)\\n"}'
+        response = self.client.patch(self.url, data, content_type='application/json',
+                                     HTTP_ACCEPT='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(self.url, data, content_type='application/json',
+                                     HTTP_ACCEPT='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        response = self.client.delete(self.url, HTTP_ACCEPT='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        etag = self.client.get(self.url, HTTP_ACCEPT='application/json')['ETag']
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH=etag).status_code, 204)
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH=etag).status_code, 412)
+        self.assertEqual(self.client.delete(self.url).status_code, 404)
+
+
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        for index in range(5):
+            Snippet.objects.create(owner=self.owner, code=f'print({index})\n')
+
+    def test_walks_every_snippet_in_order(self):
+        seen = []
+        url = '/snippets/?page_size=2'
+        while url:
+            page = self.client.get(url, HTTP_ACCEPT='application/json').json()
+            self.assertNotIn('count', page)
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(item['id'] for item in page['results'])
+            url = page['next']
+        self.assertEqual(seen, list(Snippet.objects.order_by('created', 'id').values_list('id', flat=True)))
+
+    def test_count_is_opt_in_and_page_size_capped(self):
+        page = self.client.get('/snippets/?count=true&page_size=1000', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(page['count'], 5)
+        self.assertEqual(len(page['results']), 5)
+        self.assertEqual(self.client.get('/users/', HTTP_ACCEPT='application/json').json()['results'][0]['username'], 'alice')
+
+
+class FastPathTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='secret')
+        self.bob = User.objects.create_user('bób', password='secret')
+        User.objects.create_user('carol', password='secret')
+        codes = ['print("hello")\n', 'line\u2028separator\u2029 = "中文 😀"\n', 'tab\there\x01\x1f\x7f\n']
+        for index, code in enumerate(codes * 2):
+            Snippet.objects.create(owner=index % 2 and self.bob or self.alice, title=f'<"{index}">', code=code,
+                                   linenos=bool(index % 2), language='ruby' if index == 3 else 'python')
+
+    def assertSameResponse(self, url, params=None, **extra):
+        responses = []
+        for fast in (False, True):
+            with override_settings(SNIPPETS={'FAST_LIST_SERIALIZATION': fast}):
+                responses.append(self.client.get(url, params, **extra))
+        slow, fast = responses
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast['Content-Type'], slow['Content-Type'])
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_snippet_list(self):
+        self.assertSameResponse('/snippets/', HTTP_ACCEPT='application/json')
+        self.assertSameResponse('/snippets/', {'page_size': 100, 'count': 'true'}, HTTP_ACCEPT='application/json')
+        self.assertSameResponse('/snippets.json', {'owner': 'bób'})
+        self.assertSameResponse('/snippets/', {'search': 'print', 'page_size': 1}, HTTP_ACCEPT='application/json')
+
+    def test_snippet_list_next_pages(self):
+        url = '/snippets/?page_size=2'
+        while url:
+            url = self.assertSameResponse(url, HTTP_ACCEPT='application/json').json()['next']
+
+    def test_user_list(self):
+        self.assertSameResponse('/users/', HTTP_ACCEPT='application/json')
+        self.assertSameResponse('/users.json', {'page_size': 2})
+        self.assertSameResponse('/users/', HTTP_ACCEPT='application/json; indent=4')
+
+    def test_renderer_backends_agree(self):
+        values = [{'created': timezone.now(), 'price': Decimal('1.10'), 1: None, 'text': 'a\u2028b\u2029c\x00é'},
+                  ['中文', 2 ** 70, (1, 2), True], None]
+        for data in values:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        # 浮点数只保证值相同
+        data = [1e16, 2.5e-05, 0.1, -0.0]
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+
+@override_settings(SNIPPETS={'RESPONSE_CACHE_ALIAS': 'default'})
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('alice', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet = Snippet.objects.create(owner=self.owner, title='first', code='print(1)\n')
+            self.other = Snippet.objects.create(owner=self.owner, title='second', code='print(2)\n')
+
+    def get(self, url, **extra):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **extra)
+
+    def test_repeated_reads_skip_the_database(self):
+        urls = ['/snippets/', f'/snippets/{self.snippet.pk}/', '/users/', f'/users/{self.owner.pk}/']
+        first = [self.get(url) for url in urls]
+        highlight_page = self.client.get(f'/snippets/{self.snippet.pk}/highlight/')
+        with self.assertNumQueries(0):
+            for url, response in zip(urls, first):
+                cached = self.get(url)
+                self.assertEqual(cached.content, response.content)
+                self.assertEqual(cached['ETag'], response['ETag'])
+            self.assertEqual(self.client.get(f'/snippets/{self.snippet.pk}/highlight/').content,
+                             highlight_page.content)
+            response = self.get('/snippets/', HTTP_IF_NONE_MATCH=first[0]['ETag'])
+            self.assertEqual(response.status_code, 304)
+        self.assertGreater(metrics.RESPONSE_CACHE.get(result='hit'), 0)
+
+    def test_key_includes_format_and_query(self):
+        self.get('/snippets/')
+        with self.assertNumQueries(0):
+            self.get('/snippets/')
+        self.assertNotEqual(self.client.get('/snippets.json').content, self.get('/snippets/?page_size=1').content)
+        self.assertEqual(len(self.get('/snippets/?page_size=1').json()['results']), 1)
+
+    def test_browsable_api_is_not_cached(self):
+        first = self.client.get('/snippets/', HTTP_ACCEPT='text/html')
+        self.assertContains(first, 'csrfToken')
+        self.client.cookies.clear()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/snippets/', HTTP_ACCEPT='text/html')
+        self.assertTrue(queries.captured_queries)
+        self.assertNotEqual(first.cookies['csrftoken'].value, second.cookies['csrftoken'].value)
+
+    def test_writes_invalidate_affected_entries(self):
+        self.get('/snippets/')
+        self.get(f'/snippets/{self.other.pk}/')
+        self.get('/users/')
+        self.client.login(username='alice', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/snippets/{self.snippet.pk}/', {'title': 'changed'}, content_type='application/json')
+        self.client.logout()
+        titles = [item['title'] for item in self.get('/snippets/').json()['results']]
+        self.assertIn('changed', titles)
+        with self.assertNumQueries(0):
+            self.get(f'/snippets/{self.other.pk}/')
+            self.get('/users/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.username = 'renamed'
+            self.owner.save()
+        self.assertEqual(self.get(f'/snippets/{self.other.pk}/').json()['owner'], 'renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        self.assertEqual(len(self.get('/users/').json()['results'][0]['snippets']), 1)
+
+    def test_authenticated_reads_bypass_cache(self):
+        self.get('/snippets/')
+        self.client.login(username='alice', password='secret')
+        with CaptureQueriesContext(connection) as context:
+            self.get('/snippets/')
+        self.assertGreater(len(context.captured_queries), 0)
+
+    @override_settings(SNIPPETS={'RESPONSE_CACHE_ALIAS': 'default', 'RESPONSE_CACHE_TIMEOUT': 0})
+    def test_stale_entry_served_while_rebuilding(self):
+        first = self.get('/snippets/')
+        with mock.patch('snippets.response_cache.acquire', return_value=False), \
+                mock.patch('snippets.response_cache.aacquire', return_value=False), self.assertNumQueries(0):
+            self.assertEqual(self.get('/snippets/').content, first.content)
+        with CaptureQueriesContext(connection) as context:
+            self.get('/snippets/')
+        self.assertGreater(len(context.captured_queries), 0)
+
+
+@override_settings(ROOT_URLCONF=benchmarks.build_urlconf(async_views=True))
+class AsyncViewTests(TestCase):
+    """通过ASGI处理请求，见`snippets.async_views`"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        for index in range(3):
+            Snippet.objects.create(owner=self.owner, title=f'snippet {index}', code=f'print({index})\n')
+        self.snippet = Snippet.objects.first()
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    @override_settings(ROOT_URLCONF='tutorial.urls')
+    def sync_get(self, url):
+        return self.client.get(url)
+
+    def test_read_actions_are_async(self):
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/snippets/', urlconf='tutorial.urls').func))
+        for url in ('/snippets/', f'/snippets/{self.snippet.pk}/', f'/snippets/{self.snippet.pk}/highlight/',
+                    '/users/', f'/users/{self.owner.pk}/'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    async def test_responses_match_sync_views(self):
+        for url in ('/snippets/', f'/snippets/{self.snippet.pk}/', f'/snippets/{self.snippet.pk}/highlight/',
+                    '/users/', f'/users/{self.owner.pk}/', '/snippets/?format=json&page_size=2'):
+            expected = await sync_to_async(self.sync_get)(url)
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.content, expected.content, url)
+            self.assertEqual(response['ETag'], expected['ETag'], url)
+
+    async def test_conditional_and_missing(self):
+        url = f'/snippets/{self.snippet.pk}/'
+        response = await self.async_client.get(url)
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        for url in ('/snippets/999/', '/snippets/abc/highlight/', '/users/999/'):
+            self.assertEqual((await self.async_client.get(url)).status_code, 404, url)
+
+    @override_settings(SNIPPETS={'RESPONSE_CACHE_ALIAS': 'default'})
+    def test_response_cache(self):
+        # 同步的测试客户端也会执行异步视图（Django用`async_to_sync`调用）
+        cache.clear()
+        for url in ('/snippets/', f'/snippets/{self.snippet.pk}/highlight/', '/users/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).content, first.content)
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    async def test_chunked_snippet_is_streamed_asynchronously(self):
+        code = benchmarks.make_code('python', 1200)
+        snippet = await sync_to_async(Snippet.objects.create)(owner=self.owner, code=code)
+        response = await self.async_client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertTrue(response.is_async)
+        self.assertIn(highlight.render(code, 'python', 'friendly', False), await self.read(response))
+        response = await self.async_client.get(f'/snippets/{snippet.pk}/highlight/', {'lines': '1'})
+        self.assertIn('<span class="k">', response.content.decode())
+        response = await self.async_client.get(f'/snippets/{self.snippet.pk}/highlight/', {'lines': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_line_range_renders_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+
+        def render(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return highlight.stream_fragment(*args, **kwargs)
+
+        with mock.patch('snippets.views.stream_fragment', render):
+            response = await self.async_client.get(f'/snippets/{self.snippet.pk}/highlight/', {'lines': '1'})
+        self.assertIn('<span class="nb">print</span>', response.content.decode())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    @override_settings(ROOT_URLCONF='tutorial.urls', SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    async def test_sync_views_stream_asynchronously(self):
+        # 同步视图在ASGI下的流式响应也不能被Django整个读入内存
+        code = benchmarks.make_code('python', 1200)
+        snippet = await sync_to_async(Snippet.objects.create)(owner=self.owner, code=code)
+        response = await self.async_client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertTrue(response.is_async)
+        self.assertIn(highlight.render(code, 'python', 'friendly', False), await self.read(response))
+        response = await self.async_client.get('/snippets/export/?format=csv&fields=id')
+        self.assertTrue(response.is_async)
+        self.assertEqual(len((await self.read(response)).splitlines()), 5)
+
+    async def test_writes_use_sync_views(self):
+        await self.async_client.alogin(username='alice', password='secret')
+        response = await self.async_client.post('/snippets/', {'code': 'print(4)\n'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await Snippet.objects.acount(), 4)
+        response = await self.async_client.get('/snippets/?page_size=10')
+        self.assertEqual(len(response.json()['results']), 4)
+
+    async def test_basic_auth_uses_sync_view(self):
+        credentials = base64.b64encode(b'alice:secret').decode()
+        response = await self.async_client.get('/snippets/', headers={'Authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/snippets/', headers={'Authorization': 'Basic bad'})
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(SNIPPETS={'READ_REPLICAS': ['replica_a', 'replica_b'], 'REPLICA_LAG_CHECK_SECONDS': 0})
+class ReplicaRoutingTests(TransactionTestCase):
+    """用临时目录中的SQLite文件作为只读副本，见`snippets.db_routers`
+
+    `TestCase`把每个测试包在主库的事务中，而事务中的读查询总是使用主库，所以这里使用`TransactionTestCase`。"""
+    replicas = ('replica_a', 'replica_b')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        for alias in cls.replicas:
+            connections.settings[alias] = {**connections.settings['default'],
+                                           'NAME': os.path.join(directory.name, f'{alias}.sqlite3')}
+            cls.addClassCleanup(cls.remove_alias, alias)
+        # 副本不是测试数据库，测试运行器不会创建它们，所以在检查`databases`之后才加入
+        cls.databases = cls.databases | set(cls.replicas)
+
+    @staticmethod
+    def remove_alias(alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def setUp(self):
+        db_routers.reset_checks()
+        self.addCleanup(db_routers.reset_checks)
+        self.owner = User.objects.create_user('alice', password='secret')
+        Snippet.objects.create(owner=self.owner, title='replicated', code='print(1)\n')
+
+    def sync(self):
+        call_command('sync_sqlite_replicas', stdout=io.StringIO())
+
+    def titles(self):
+        return [row['title'] for row in self.client.get('/snippets/', HTTP_ACCEPT='application/json').json()['results']]
+
+    def test_reads_use_replicas_and_writes_use_primary(self):
+        self.sync()
+        Snippet.objects.create(owner=self.owner, title='primary only', code='print(2)\n')
+        with CaptureQueriesContext(connections['replica_a']) as a, CaptureQueriesContext(connections['replica_b']) as b:
+            for _ in range(4):
+                self.assertEqual(self.titles(), ['replicated'])
+        # 轮询：两个副本各处理一半的请求
+        self.assertEqual(len(a.captured_queries), len(b.captured_queries))
+        self.assertGreater(len(a.captured_queries), 0)
+
+        self.client.login(username='alice', password='secret')
+        response = self.client.post('/snippets/', {'title': 'new', 'code': 'print(3)\n'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Snippet.objects.using('default').count(), 3)
+        self.assertEqual(Snippet.objects.using('replica_a').count(), 1)
+
+    @override_settings(SNIPPETS={'READ_REPLICAS': ['replica_a', 'replica_b'], 'REPLICA_LAG_CHECK_SECONDS': 0,
+                                 'REPLICA_STICKY_SECONDS': 1})
+    def test_read_your_writes(self):
+        self.sync()
+        self.client.login(username='alice', password='secret')
+        response = self.client.post('/snippets/', {'title': 'new', 'code': 'print(3)\n'})
+        self.assertIn(db_routers.PIN_COOKIE, response.cookies)
+        # 不短于副本可能落后的`REPLICA_MAX_LAG_SECONDS`（加上检查结果复用的时间）
+        self.assertEqual(response.cookies[db_routers.PIN_COOKIE]['max-age'], 10)
+        self.assertEqual(self.titles(), ['replicated', 'new'])
+        del self.client.cookies[db_routers.PIN_COOKIE]
+        self.assertEqual(self.titles(), ['replicated'])
+
+    def test_lagging_or_missing_replicas_fall_back_to_primary(self):
+        self.sync()
+        Snippet.objects.create(owner=self.owner, title='primary only', code='print(2)\n')
+        with mock.patch('snippets.db_routers.replica_lag', return_value=60), \
+                self.assertLogs('snippets.db_routers', 'WARNING'):
+            self.assertEqual(self.titles(), ['replicated', 'primary only'])
+        db_routers.reset_checks()
+        os.remove(connections.settings['replica_a']['NAME'])
+        with CaptureQueriesContext(connections['replica_b']) as b, self.assertLogs('snippets.db_routers', 'WARNING'):
+            for _ in range(2):
+                self.assertEqual(self.titles(), ['replicated'])
+        self.assertGreater(len(b.captured_queries), 0)
+
+    @override_settings(ROOT_URLCONF=benchmarks.build_urlconf(async_views=True))
+    async def test_async_views_read_from_replicas(self):
+        await sync_to_async(self.sync)()
+        await Snippet.objects.acreate(owner=self.owner, title='primary only', code='print(2)\n')
+        response = await self.async_client.get('/snippets/', headers={'Accept': 'application/json'})
+        self.assertEqual([row['title'] for row in response.json()['results']], ['replicated'])
+
+    def test_router(self):
+        router = db_routers.ReplicaRouter()
+        self.sync()
+        self.assertIsNone(router.db_for_read(Snippet))
+        with db_routers.read_from_replicas():
+            alias = router.db_for_read(Snippet)
+            self.assertIn(alias, self.replicas)
+            # 同一个请求中的查询使用同一个副本
+            self.assertEqual(router.db_for_read(User), alias)
+            self.assertEqual(router.db_for_write(Snippet), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Snippet), 'default')
+            with db_routers.use_primary():
+                self.assertIsNone(router.db_for_read(Snippet))
+        self.assertFalse(router.allow_migrate('replica_a', 'snippets'))
+        self.assertIsNone(router.allow_migrate('default', 'snippets'))
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(12):
+            owner = User.objects.create_user(f'user{index}', password='secret')
+            for number in range(3):
+                Snippet.objects.create(owner=owner, code=f'print({index}, {number})\n')
+        cls.owner = owner
+
+    # 预算中包括计算ETag的查询，见`ConditionalMixin`
+    def test_snippet_list(self):
+        self.assertQueryBudget('/snippets/', max_queries=2, HTTP_ACCEPT='application/json')
+
+    def test_user_list(self):
+        self.assertQueryBudget('/users/', max_queries=4, HTTP_ACCEPT='application/json')
+
+    def test_list_skips_highlighted(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+        self.assertFalse(any('snippets_blob' in query['sql'] for query in context.captured_queries))
+
+    def test_owner_check_does_not_load_user(self):
+        self.client.login(username=self.owner.username, password='secret')
+        snippet = self.owner.snippets.first()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/snippets/{snippet.pk}/', '{"title": "t"}',
+                                         content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        user_queries = [q for q in context.captured_queries if 'FROM "auth_user"' in q['sql']]
+        self.assertEqual(len(user_queries), 1)  # 只有认证时加载当前用户
+
+
+class BulkCreateTests(TestCase):
+
+    def setUp(self):
+        highlight.reset_cache()
+        self.owner = User.objects.create_user('alice', password='secret')
+        self.client.login(username='alice', password='secret')
+
+    def test_json_array_reports_item_errors(self):
+        items = [{'code': f'print({index})\n'} for index in range(3)]
+        items.insert(1, {'code': 'x', 'language': 'no-such-language'})
+        response = self.client.post('/snippets/bulk/', items, content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        for snippet in Snippet.objects.all():
+            self.assertEqual(snippet.owner, self.owner)
+            self.assertEqual(snippet.highlighted, highlight.render(*snippet.render_inputs()))
+
+    @override_settings(SNIPPETS={'BULK_BATCH_SIZE': 2})
+    def test_ndjson_stream_in_batches(self):
+        body = '\n'.join('{"code": "print(%d)\\n", "language": "rust"}' % index for index in range(5))
+        response = self.client.post('/snippets/bulk/', body, content_type='application/x-ndjson',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'created': 5, 'errors': []})
+        self.assertEqual(Snippet.objects.filter(language='rust').count(), 5)
+
+    @override_settings(SNIPPETS={'BULK_BATCH_SIZE': 2})
+    def test_ndjson_reports_malformed_lines(self):
+        body = '{"code": "a = 1\\n"}\n{"code": "b = 2\\n"}\n\n{"code": \n{"code": "c = 3\\n"}\n'
+        response = self.client.post('/snippets/bulk/', body, content_type='application/x-ndjson',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+        [error] = response.json()['errors']
+        self.assertEqual(error['index'], 2)
+        self.assertIn('line 4', error['errors']['non_field_errors'][0])
+
+    def test_rejects_single_object(self):
+        response = self.client.post('/snippets/bulk/', {'code': 'x'}, content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        alice = User.objects.create_user('alice', password='secret')
+        bob = User.objects.create_user('bob', password='secret')
+        Snippet.objects.create(owner=alice, code='print(1)\n', title='one')
+        Snippet.objects.create(owner=bob, code='puts 2\n', language='ruby', title='two, "quoted"')
+
+    def read(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        lines = self.read('/snippets/export/').splitlines()
+        self.assertEqual([json.loads(line)['owner'] for line in lines], ['alice', 'bob'])
+        self.assertNotIn('highlighted', json.loads(lines[0]))
+
+    def test_csv_with_fields_and_filters(self):
+        content = self.read('/snippets/export/?format=csv&fields=title,highlighted&owner=bob')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['title', 'highlighted'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], 'two, "quoted"')
+        self.assertIn('class="highlight"', rows[1][1])
+
+    @override_settings(SNIPPETS={'HIGHLIGHT_MAX_BYTES': 1000})
+    def test_highlighted_of_chunked_snippet(self):
+        code = benchmarks.make_code('python', 1200)
+        snippet = Snippet.objects.create(owner=User.objects.get(username='bob'), code=code)
+        self.assertEqual(snippet.render_status, Snippet.RENDER_CHUNKED)
+        lines = self.read('/snippets/export/?fields=id,highlighted').splitlines()
+        self.assertEqual(json.loads(lines[-1]), {'id': snippet.pk,
+                                                 'highlighted': highlight.render(code, 'python', 'friendly', False)})
+        self.assertIn('class="highlight"', json.loads(lines[0])['highlighted'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/snippets/export/?fields=nope').status_code, 400)
+        self.assertEqual(self.client.get('/snippets/export/?created_after=yesterday').status_code, 400)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        self.once = Snippet.objects.create(owner=self.owner, title='greeting', code='print("hello")\n')
+        self.often = Snippet.objects.create(owner=self.owner, code='hello = "hello hello"\n')
+        self.ruby = Snippet.objects.create(owner=self.owner, code='puts "hello"\n', language='ruby')
+
+    def test_ranked_and_filtered(self):
+        response = self.client.get('/snippets/', {'search': 'hello', 'language': 'python'}, HTTP_ACCEPT='application/json')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.often.pk, self.once.pk])
+
+    def test_index_follows_save_and_delete(self):
+        self.once.code = 'print("bye")\n'
+        self.once.save()
+        self.ruby.delete()
+        ids = [item['id'] for item in self.client.get('/snippets/', {'search': 'hello'},
+                                                      HTTP_ACCEPT='application/json').json()['results']]
+        self.assertEqual(ids, [self.often.pk])
+
+    def test_prefix_quotes_and_paging(self):
+        page = self.client.get('/snippets/', {'search': 'hel* "', 'page_size': 2}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(len(page['results']), 2)
+        page = self.client.get(page['next'], HTTP_ACCEPT='application/json').json()
+        self.assertEqual(len(page['results']), 1)
+        self.assertIsNone(page['next'])
+
+    def test_bulk_import_and_rebuild(self):
+        self.client.login(username='alice', password='secret')
+        self.client.post('/snippets/bulk/', [{'code': 'needle = 1\n'}], content_type='application/json')
+        for rebuild in (False, True):
+            if rebuild:
+                call_command('rebuild_search_index', stdout=io.StringIO())
+            response = self.client.get('/snippets/', {'search': 'needle'}, HTTP_ACCEPT='application/json')
+            self.assertEqual(len(response.json()['results']), 1)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_summarize(self):
+        result = benchmarks.summarize([0.001 * n for n in range(1, 101)], [2] * 100, elapsed=2.0, errors=1)
+        self.assertEqual(result['throughput_rps'], 50)
+        self.assertAlmostEqual(result['latency_ms']['p50'], 50.5)
+        self.assertAlmostEqual(result['latency_ms']['p99'], 99.01)
+        self.assertEqual(result['queries']['max'], 2)
+
+    def test_seed(self):
+        benchmarks.seed(users=2, snippets=5)
+        self.assertEqual(Snippet.objects.filter(owner__username__startswith='bench-').count(), 5)
+        self.assertFalse(Snippet.objects.filter(highlighted_blob__isnull=True).exists())
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        highlight.reset_cache()
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def test_request_and_hook_metrics(self):
+        self.client.login(username='alice', password='secret')
+        self.client.post('/snippets/', '{"code": "print(1)\\n", "language": "ruby"}',
+                         content_type='application/json', HTTP_ACCEPT='application/json')
+        self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+
+        labels = {'view': 'SnippetViewSet', 'action': 'list', 'method': 'GET'}
+        self.assertEqual(metrics.REQUESTS.get(status=200, **labels), 1)
+        self.assertEqual(metrics.DB_QUERIES.get(**labels)['count'], 1)
+        self.assertEqual(metrics.HIGHLIGHT_SECONDS.get(language='ruby', style='friendly')['count'], 1)
+        self.assertEqual(metrics.SERIALIZER_SECONDS.get(serializer='SnippetValuesSerializer', many=True)['count'], 1)
+        self.assertEqual(metrics.PERMISSION_SECONDS.get(view='SnippetViewSet', action='create')['count'], 1)
+        self.assertEqual(metrics.RENDER_SECONDS.get(view='SnippetViewSet', action='list', renderer='json')['count'], 1)
+
+        User.objects.filter(username='alice').update(is_staff=True)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('snippets_http_requests_total{view="SnippetViewSet",action="list",method="GET",status="200"} 1', body)
+        self.assertIn('snippets_highlighted_bytes_bucket{language="ruby",style="friendly",le="+Inf"} 1', body)
+        self.assertIn('snippets_highlight_cache{stat="misses"} 1', body)
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.login(username='alice', password='secret')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(SNIPPETS={'METRICS_ALLOWED_IPS': ['10.0.0.1']}):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+            self.client.logout()
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+        User.objects.filter(username='alice').update(is_staff=True)
+        self.client.login(username='alice', password='secret')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_slow_request_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(SNIPPETS={'PROFILE_SAMPLE_RATE': 1, 'PROFILE_SLOW_SECONDS': 0, 'PROFILE_DIR': directory}):
+                self.client.get('/users/', HTTP_ACCEPT='application/json')
+            self.assertEqual(len([name for name in os.listdir(directory) if 'UserViewSet-list' in name]), 1)
+
+
+class ChoiceTablesTests(TestCase):
+
+    def test_precomputed_tables_match_installed_pygments(self):
+        self.assertEqual((choices.LANGUAGE_CHOICES, choices.STYLE_CHOICES), choices.build_tables())
+
+
+@override_settings(SNIPPETS={'ASYNC_HIGHLIGHT': True})
+class AsyncHighlightTests(TestCase):
+
+    def setUp(self):
+        highlight.reset_cache()
+        self.owner = User.objects.create_user('alice', password='secret')
+
+    def test_save_defers_rendering(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(snippet.render_status, Snippet.RENDER_PENDING)
+        response = self.client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertEqual(response.status_code, 202)
+
+        future = Future()
+        inputs = snippet.render_inputs()
+        future.set_result(highlight.timed_render(*inputs))
+        store_highlight(snippet.pk, inputs, future)
+        snippet.refresh_from_db()
+        self.assertEqual(snippet.render_status, Snippet.RENDER_DONE)
+        response = self.client.get(f'/snippets/{snippet.pk}/highlight/')
+        self.assertContains(response, 'highlight')
+
+    def test_cached_render_is_stored_immediately(self):
+        highlight.cached_render('print(2)\n', 'python', 'friendly', False)
+        snippet = Snippet.objects.create(owner=self.owner, code='print(2)\n')
+        self.assertEqual(snippet.render_status, Snippet.RENDER_DONE)
+
+    def test_stale_result_is_discarded(self):
+        with self.captureOnCommitCallbacks():
+            snippet = Snippet.objects.create(owner=self.owner, code='print(3)\n')
+        future = Future()
+        future.set_result(('<p>old</p>', 0.1))
+        store_highlight(snippet.pk, ('print(0)\n', 'python', 'friendly', False), future)
+        snippet.refresh_from_db()
+        self.assertEqual(snippet.render_status, Snippet.RENDER_PENDING)
+
+    def test_saving_pending_instance_keeps_finished_render(self):
+        with self.captureOnCommitCallbacks():
+            snippet = Snippet.objects.create(owner=self.owner, code='print(4)\n')
+        future = Future()
+        inputs = snippet.render_inputs()
+        future.set_result(highlight.timed_render(*inputs))
+        store_highlight(snippet.pk, inputs, future)
+        # 实例在渲染完成之前读取，只修改标题
+        snippet.title = 'renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            snippet.save()
+        self.assertEqual(callbacks, [])
+        snippet.refresh_from_db()
+        self.assertEqual(snippet.render_status, Snippet.RENDER_DONE)
+        self.assertIn('highlight', snippet.highlighted)
@@ -3,12 +3,19 @@ from rest_framework.routers import DefaultRouter
 from snippets import views
 
 
-# 创建路由器并注册我们的视图。
-router = DefaultRouter()
-router.register(prefix=r'snippets', viewset=views.SnippetViewSet)
-router.register(prefix=r'users', viewset=views.UserViewSet)
-
-# API URL现在有路由器自动确定
-urlpatterns = [
-    path('', include(router.urls)),
-]
\ No newline at end of file
+def get_urlpatterns():
+    """每次调用都重新生成视图集的视图，`SNIPPETS['ASYNC_VIEWS']`在这时读取"""
+    # 创建路由器并注册我们的视图。
+    router = DefaultRouter()
+    router.register(prefix=r'snippets', viewset=views.SnippetViewSet)
+    router.register(prefix=r'users', viewset=views.UserViewSet)
+
+    # API URL现在有路由器自动确定
+    return [
+        path('metrics', views.metrics_view, name='metrics'),
+        path('snippets/styles/<str:style>.css', views.style_stylesheet, name='snippet-style'),
+        path('', include(router.urls)),
+    ]
+
+
+urlpatterns = get_urlpatterns()
@@ -14,23 +14,87 @@ request.data可以处理传入的json请求，但它也可以处理其他格式
 而不是`get`或`put`等 *方法处理程序*
 """
 
+import hashlib
+import types
+from functools import lru_cache, partial
+
+import pygments
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from rest_framework import permissions, renderers, viewsets
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db.models import Count, Max, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.html import escape
+from django.views.decorators.http import require_safe
+from rest_framework import permissions, renderers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError as APIValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from .models import Snippet
+from . import metrics
+from .async_views import AsyncReadMixin, stream_wrapper
+from .bulk import import_snippets
+from .conditional import ConditionalMixin
+from .conf import snippets_setting
+from .export import CSVRenderer, NDJSONRenderer, parse_fields, stream_csv, stream_ndjson
+from .fastpath import FastListMixin, SnippetValuesSerializer, UserValuesSerializer
+from .filters import SnippetFilterBackend, SnippetSearchFilter
+from .highlight import (MAX_BUFFERED_LINES, cache_stats, is_oversized, render_page, stream_fragment, stream_page,
+                        style_css)
+from .models import STYLE_CHOICES, CollectionVersion, Snippet
+from .pagination import SearchPagination, SnippetCursorPagination, UserCursorPagination
+from .parsers import NDJSONParser
 from .permissions import IsOwnerOrReadOnly
+from .renderers import FastJSONRenderer
+from .response_cache import ResponseCacheMixin
 from .serializers import SnippetModelSerializer, UserModelSerializer
 
+RENDER_PENDING_PAGE = '<p>Highlighting in progress, please retry shortly.</p>'
+
+
+def parse_line_range(value):
+    """解析`highlight`的`lines`参数：`10-20`、`10-`（到最后一行）或`10`，行号从1开始"""
+    if value is None:
+        return None
+    first, sep, last = value.partition('-')
+    try:
+        start = int(first)
+        end = int(last) if last else None if sep else start
+    except ValueError:
+        raise APIValidationError({'lines': 'Expected a line range such as "10-20".'})
+    if start < 1 or end is not None and end < start:
+        raise APIValidationError({'lines': 'Line numbers start at 1 and the range must not be reversed.'})
+    return start, end
+
+
+class InstrumentedViewMixin:
+    """记录权限检查的耗时，见`snippets.metrics`"""
 
-class SnippetViewSet(viewsets.ModelViewSet):
+    def check_permissions(self, request):
+        with metrics.PERMISSION_SECONDS.time(view=type(self).__name__, action=self.action or ''):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with metrics.PERMISSION_SECONDS.time(view=type(self).__name__, action=self.action or ''):
+            super().check_object_permissions(request, obj)
+
+
+class SnippetViewSet(InstrumentedViewMixin, AsyncReadMixin, ResponseCacheMixin, ConditionalMixin, FastListMixin,
+                     viewsets.ModelViewSet):
     """此视图自动提供`list`, `create`, `retrieve`, `update`和`destroy`操作
 
     另外我们还提供了一个额外的`highlight`操作"""
     queryset = Snippet.objects.all()
     serializer_class = SnippetModelSerializer
+    values_serializer_class = SnippetValuesSerializer
+    renderer_classes = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+    pagination_class = SnippetCursorPagination
+    filter_backends = [SnippetFilterBackend, SnippetSearchFilter]
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    async_actions = ('list', 'retrieve', 'highlight')
 
     # 使用`@action`装饰器创建一个名为`highlight`的自定义*操作*
     # 这个装饰器可用于条件不符合标准`create`/`update`/`delete`样式的任何自定义路径
@@ -42,14 +106,223 @@ class SnippetViewSet(viewsets.ModelViewSet):
     # 如果要更改URL的构造方式，可以为装饰器设置url_path关键字参数
     @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
+        return self.cached(partial(self.conditional, self.highlight_page), request, *args, **kwargs)
+
+    def highlight_page(self, request, *args, **kwargs):
         snippet = self.get_object()
-        return Response(snippet.highlighted)
+        lines = parse_line_range(request.query_params.get('lines'))
+        chunks = None
+        if snippet.render_status == Snippet.RENDER_CHUNKED:
+            chunks = list(snippet.chunks_for(*snippet.line_range(lines)))
+        return self.highlight_response(request, snippet, lines, chunks, wrap_stream=stream_wrapper(request))
+
+    async def ahighlight(self, request, *args, **kwargs):
+        return await self.acached(partial(self.aconditional, self.ahighlight_page), request, *args, **kwargs)
+
+    async def ahighlight_page(self, request, *args, **kwargs):
+        snippet = await self.aget_object()
+        lines = parse_line_range(request.query_params.get('lines'))
+        chunks = None
+        if snippet.render_status == Snippet.RENDER_CHUNKED:
+            chunks = [chunk async for chunk in snippet.chunks_for(*snippet.line_range(lines))]
+        elif snippet.render_status == Snippet.RENDER_DONE and lines is None:
+            # 较大的高亮结果解压也比较耗时，在线程池中先访问一次，之后直接使用解压的结果
+            await sync_to_async(getattr, thread_sensitive=False)(snippet, 'highlighted')
+        if lines is not None:
+            # 行范围的页面直接生成，没有逐块保存的代码段还需要词法分析，不能阻塞事件循环
+            return await sync_to_async(self.highlight_response, thread_sensitive=False)(
+                request, snippet, lines, chunks, wrap_stream=stream_wrapper(request))
+        return self.highlight_response(request, snippet, lines, chunks, wrap_stream=stream_wrapper(request))
+
+    def highlight_response(self, request, snippet, lines=None, chunks=None, wrap_stream=None):
+        """`lines`是请求的行范围，`chunks`是逐块保存的代码段中包含这些行的块（见`Snippet.chunks_for()`），
+        `wrap_stream`转换流式输出的迭代器，ASGI下用它把逐块渲染放到线程池中"""
+        css_url = f"{reverse('snippet-style', args=[snippet.style], request=request)}?v={pygments.__version__}"
+        buffered = lines is not None
+        if chunks is not None:
+            start, end = snippet.line_range(lines)
+            fragments = snippet.stream_chunks(chunks, start, end)
+            # `?lines=1-`这样很大的范围和整页一样不在内存中生成
+            buffered = buffered and end - start < MAX_BUFFERED_LINES
+        elif lines is not None or snippet.render_status == Snippet.RENDER_STREAMED:
+            # 没有逐块保存的代码段从token流格式化
+            start, end = lines or (1, None)
+            fragments = stream_fragment(*snippet.render_inputs(), start=start, end=end)
+        else:
+            fragments = None
+        if fragments is not None:
+            # 行范围的页面直接生成，可以放入响应缓存；超大代码段的整页和大范围逐块输出，不在内存中生成
+            if buffered and (chunks is not None or not is_oversized(snippet.code)):
+                return Response(render_page(''.join(fragments), snippet.title, css_url))
+            stream = stream_page(fragments, snippet.title, css_url)
+            return StreamingHttpResponse(wrap_stream(stream) if wrap_stream else stream,
+                                         content_type='text/html; charset=utf-8')
+        # 后台渲染尚未完成时返回202和一个占位页面
+        if snippet.render_status == Snippet.RENDER_PENDING:
+            return Response(RENDER_PENDING_PAGE, status=status.HTTP_202_ACCEPTED, headers={'Retry-After': '1'})
+        # 数据库中只保存高亮片段，在这里包装成完整页面并引用该样式的共享CSS；渲染失败时直接显示未高亮的代码
+        if snippet.render_status == Snippet.RENDER_DONE:
+            fragment = snippet.highlighted
+        else:
+            fragment = f'<pre>{escape(snippet.code)}</pre>'
+        return Response(render_page(fragment, snippet.title, css_url))
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    def bulk_create(self, request, *args, **kwargs):
+        """批量创建代码段，请求体是JSON数组或NDJSON（每行一个代码段）
+
+        验证失败的条目不会影响其他条目，响应中按条目序号列出错误。"""
+        items = request.data
+        if not isinstance(items, (list, types.GeneratorType)):
+            return Response({'detail': 'Expected a JSON array or an NDJSON stream of snippets.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        created, errors = import_snippets(items, owner=request.user, serializer_class=self.get_serializer_class(),
+                                          context=self.get_serializer_context())
+        if errors and not created:
+            return Response({'created': created, 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created, 'errors': errors}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        """以NDJSON（默认）或CSV流式导出全部代码段，支持与列表相同的过滤参数
+
+        `fields`参数选择输出的字段，例如`/snippets/export/?format=csv&fields=id,title,code`"""
+        fields = parse_fields(request.query_params.get('fields'))
+        queryset = self.filter_queryset(self.get_queryset())
+        chunk_size = snippets_setting('EXPORT_CHUNK_SIZE')
+        if request.accepted_renderer.format == 'csv':
+            stream = stream_csv(queryset, fields, chunk_size)
+        else:
+            stream = stream_ndjson(queryset, fields, chunk_size)
+        # 逐块读取数据库，ASGI下在视图所在的线程中迭代
+        wrap_stream = stream_wrapper(request, thread_sensitive=True)
+        response = StreamingHttpResponse(wrap_stream(stream) if wrap_stream else stream,
+                                         content_type=f'{request.accepted_media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="snippets.{request.accepted_renderer.format}"'
+        return response
+
+    @property
+    def paginator(self):
+        # 搜索结果按相关度排序，不能使用按(created, id)定位的游标分页
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get(SnippetSearchFilter.search_param, '').strip():
+                self._paginator = SearchPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        # `owner`字段显示所有者的用户名，一起查询出来，避免每个代码段再查询一次`User`
+        queryset = super().get_queryset().select_related('owner')
+        if self.action == 'highlight':
+            # 高亮结果保存在`Blob`表中，只有这个操作需要，其他操作不会查询也不会解压
+            queryset = queryset.select_related('highlighted_blob')
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def get_cache_versions(self):
+        if self.action == 'list':
+            return ['snippets']
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # 版本名称使用规范的主键，`/snippets/01/`这样的URL不缓存
+        if not (pk.isascii() and pk.isdigit()) or str(int(pk)) != pk:
+            return None
+        return [f'snippet:{pk}']
+
+    def get_validators(self):
+        if self.action == 'list':
+            # 集合的版本号由代码段和用户的修改递增，见`response_cache.bump()`
+            return ('snippets', CollectionVersion.objects.version('snippets')), None
+
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            row = Snippet.objects.filter(pk=pk).values_list('updated', 'owner__username').first()
+        except (TypeError, ValueError, ValidationError):
+            return None
+        if row is None:
+            return None
+        # 响应中有作者的用户名，改名时`snippets.signals`也会更新`updated`，ETag同样带上用户名
+        updated, owner = row
+        if self.action == 'highlight':
+            # 高亮页面中的样式表链接带有Pygments版本
+            return ('highlight', pk, updated, owner, pygments.__version__,
+                    self.request.query_params.get('lines')), updated
+        return ('snippet', pk, updated, owner), updated
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+
+class UserViewSet(InstrumentedViewMixin, AsyncReadMixin, ResponseCacheMixin, ConditionalMixin, FastListMixin,
+                  viewsets.ReadOnlyModelViewSet):
     """只读 此视图自动提供`list`和`detail`操作"""
-    queryset = User.objects.all()
+    # 生成代码段的超链接只需要主键，预先查询时只取出主键和用于归组的外键
+    queryset = User.objects.prefetch_related(
+        Prefetch('snippets', queryset=Snippet.objects.only('id', 'owner')),
+    )
     serializer_class = UserModelSerializer
+    values_serializer_class = UserValuesSerializer
+    renderer_classes = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+    pagination_class = UserCursorPagination
+
+    def get_cache_versions(self):
+        if self.action == 'list':
+            return ['users']
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # 版本名称使用规范的主键，`/users/01/`这样的URL不缓存
+        if not (pk.isascii() and pk.isdigit()) or str(int(pk)) != pk:
+            return None
+        return [f'user:{pk}']
+
+    def get_validators(self):
+        # `User`没有修改时间，用户数据之外只需要关心它的代码段链接（代码段的新增和删除）
+        if self.action == 'list':
+            return ('users', CollectionVersion.objects.version('users')), None
+
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            row = User.objects.filter(pk=pk).annotate(
+                snippet_count=Count('snippets'), last_snippet=Max('snippets__pk'),
+            ).values_list('username', 'snippet_count', 'last_snippet').first()
+        except (TypeError, ValueError, ValidationError):
+            return None
+        if row is None:
+            return None
+        return ('user', pk) + row, None
+
+
+STYLES = dict(STYLE_CHOICES)
+
+
+@lru_cache(maxsize=None)
+def stylesheet(style):
+    """返回样式`style`的CSS及其ETag"""
+    css = style_css(style)
+    return css, '"%s"' % hashlib.sha1(css.encode('utf-8')).hexdigest()
+
+
+@require_safe
+def style_stylesheet(request, style):
+    """返回某种高亮样式的CSS
+
+    CSS只随Pygments版本变化，`highlight`页面引用它时在URL中带上了版本号，所以可以长期缓存"""
+    if style not in STYLES:
+        raise Http404
+    css, etag = stylesheet(style)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(css, content_type='text/css; charset=utf-8')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
+
+
+@require_safe
+def metrics_view(request):
+    """以Prometheus文本格式输出当前进程的性能指标
+
+    指标包括各个视图的延迟和缓存命中率，只对`SNIPPETS['METRICS_ALLOWED_IPS']`中的客户端和staff用户开放"""
+    if request.META.get('REMOTE_ADDR') not in snippets_setting('METRICS_ALLOWED_IPS') and not request.user.is_staff:
+        raise PermissionDenied
+    for stat, value in cache_stats().items():
+        metrics.HIGHLIGHT_CACHE.set(value, stat=stat)
+    return HttpResponse(metrics.REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
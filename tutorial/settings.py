@@ -42,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，统计的耗时才包括其他中间件
+    'snippets.middleware.MetricsMiddleware',
+    'snippets.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,9 +82,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # 持久连接：同一个线程的请求复用连接（秒），复用前检查连接是否可用
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # 只读副本，同时加入SNIPPETS['READ_REPLICAS']，本地可以用`python manage.py sync_sqlite_replicas`从主库复制
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+    #     'CONN_MAX_AGE': 60,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+# 读写分离，没有配置副本时不做任何路由，见snippets/db_routers.py
+DATABASE_ROUTERS = ['snippets.db_routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -126,3 +143,13 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
 }
+
+# snippets应用的配置，默认值及说明见snippets/conf.py
+SNIPPETS = {
+    'HIGHLIGHT_CACHE_MAX_BYTES': 32 * 1024 * 1024,
+    'HIGHLIGHT_CACHE_ALIAS': None,
+    # 设为'default'等缓存别名后缓存匿名读请求的响应
+    'RESPONSE_CACHE_ALIAS': None,
+    # 用ASGI服务器运行`tutorial.asgi`时设为True，读请求使用异步视图
+    'ASYNC_VIEWS': False,
+}